@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+"""Headless benchmark for the backup engine.
+
+Generates a synthetic home directory, then times scanning, tree listing,
+archiving, compression and restoring separately. Each stage runs in a
+forked child so its peak RSS is measured on its own. Results are written
+as JSON so two releases can be compared with --compare.
+"""
+import os
+import sys
+import json
+import time
+import queue
+import random
+import shutil
+import argparse
+import platform
+import resource
+import tempfile
+import traceback
+import multiprocessing
+from pathlib import Path
+from threading import Event
+from datetime import datetime
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from rebornos_profile_engine import (  # noqa: E402
+    CODEC_GZIP,
+    DEFAULT_COMPRESSION_WORKERS,
+    BackupSettings,
+    ParallelCompressor,
+    ProgressCounters,
+    ScanEstimate,
+    default_backup_items,
+    directory_size,
+    list_subdirectories,
+    run_backup,
+    run_restore,
+    scan_items,
+)
+
+RESULT_VERSION = 1
+
+# Dataset shapes: name -> (description, generator)
+SHAPES = {}
+
+def shape(name, description):
+    def register(generator):
+        SHAPES[name] = (description, generator)
+        return generator
+    return register
+
+def random_bytes(rng, size):
+    return rng.getrandbits(size * 8).to_bytes(size, "little") if size else b""
+
+def text_bytes(rng, size):
+    words = [b"color", b"font", b"enabled", b"true", b"false", b"path", b"size", b"theme", b"=", b"\n"]
+    data = bytearray()
+    while len(data) < size:
+        data += rng.choice(words) + b" "
+    return bytes(data[:size])
+
+@shape("dotfiles", "many tiny config files spread over .config and .local")
+def make_dotfiles(home, rng, scale):
+    for app in range(40 * scale):
+        folder = home / rng.choice([".config", ".local/share"]) / f"app{app}"
+        folder.mkdir(parents=True, exist_ok=True)
+        for i in range(50):
+            (folder / f"settings{i}.conf").write_bytes(text_bytes(rng, rng.randint(64, 4096)))
+
+@shape("deep", "deeply nested .config trees")
+def make_deep(home, rng, scale):
+    for tree in range(4 * scale):
+        folder = home / ".config" / f"deep{tree}"
+        for depth in range(30):
+            folder = folder / f"level{depth}"
+            folder.mkdir(parents=True, exist_ok=True)
+            for i in range(5):
+                (folder / f"file{i}.json").write_bytes(text_bytes(rng, rng.randint(128, 2048)))
+
+@shape("media", "a few huge incompressible files in Pictures and Documents")
+def make_media(home, rng, scale):
+    for folder in ("Pictures", "Documents"):
+        (home / folder).mkdir(parents=True, exist_ok=True)
+        for i in range(2 * scale):
+            with open(home / folder / f"media{i}.bin", "wb") as f:
+                for _ in range(64):  # 64 MiB per file
+                    f.write(random_bytes(rng, 1024 * 1024))
+
+def generate_home(home, shapes, scale, seed):
+    rng = random.Random(seed)
+    for name in shapes:
+        SHAPES[name][1](home, rng, scale)
+    files, dirs, total = 0, 0, 0
+    for _, dirnames, filenames in os.walk(home):
+        dirs += len(dirnames)
+        files += len(filenames)
+    total = directory_size(str(home))
+    return {"files": files, "dirs": dirs, "bytes": total}
+
+# Stages: each returns (files, bytes) processed
+def stage_scan(context):
+    estimate = ScanEstimate()
+    files = sum(1 for _ in scan_items(context["items"], context["home"], Event(), estimate))
+    return files, estimate.bytes_seen
+
+def stage_tree(context):
+    folders = 0
+    for root in (".config", ".local"):
+        pending = [str(Path(context["home"]) / root)]
+        while pending:  # Expanding every row, the worst case for the tree view
+            children = list_subdirectories(pending.pop())
+            folders += len(children)
+            pending.extend(path for _, path in children)
+    return folders, 0
+
+def stage_archive(context):
+    settings = BackupSettings(save_location=context["work"] / "archive", compression_enabled=False)
+    progress = ProgressCounters()
+    result = run_backup(context["items"], settings, progress=progress, home=context["home"])
+    context["queue"].put(("tar_path", str(result.path)))
+    return progress.files, progress.bytes
+
+def stage_compress(context):
+    tar_path = context["tar_path"]
+    size = os.path.getsize(tar_path)
+    with open(tar_path, "rb") as source, open(os.devnull, "wb") as sink:
+        with ParallelCompressor(sink, CODEC_GZIP, context["level"], context["workers"]) as compressor:
+            for block in iter(lambda: source.read(1024 * 1024), b""):
+                compressor.write(block)
+    return 1, size
+
+def stage_backup(context):
+    settings = BackupSettings(save_location=context["work"] / "backup", level=context["level"], workers=context["workers"])
+    progress = ProgressCounters()
+    result = run_backup(context["items"], settings, progress=progress, home=context["home"])
+    context["queue"].put(("backup_path", str(result.path)))
+    return progress.files, progress.bytes
+
+def stage_restore(context):
+    backup_path = Path(context["backup_path"])
+    progress = ProgressCounters()
+    run_restore(backup_path.name, backup_path.parent, context["work"] / "restore", progress=progress)
+    return progress.files, progress.bytes
+
+STAGES = [
+    ("scan", stage_scan),
+    ("tree", stage_tree),
+    ("archive", stage_archive),
+    ("compress", stage_compress),
+    ("backup", stage_backup),
+    ("restore", stage_restore),
+]
+
+# Folders the harness creates inside the work folder; nothing else there is ever deleted
+WORK_FOLDERS = ("home", "archive", "backup", "restore")
+
+def run_child(stage_function, context, results):
+    started = time.perf_counter()
+    try:
+        files, num_bytes = stage_function(context)
+    except Exception:
+        results.put(("error", traceback.format_exc()))  # The parent would otherwise wait for a result forever
+        return
+    seconds = time.perf_counter() - started
+    peak_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    results.put(("result", {"seconds": seconds, "files": files, "bytes": num_bytes, "peak_rss_kb": peak_rss_kb}))
+
+def run_stage(name, stage_function, context):
+    """Runs one stage in a forked child and returns its measurements."""
+    ctx = multiprocessing.get_context("fork")
+    results = ctx.Queue()
+    context["queue"] = results
+    child = ctx.Process(target=run_child, args=(stage_function, context, results))
+    child.start()
+    measurement = None
+    while measurement is None:
+        try:
+            key, value = results.get(timeout=1)
+        except queue.Empty:
+            if not child.is_alive() and results.empty():
+                child.join()
+                raise RuntimeError(f"Stage {name} died with exit code {child.exitcode}")
+            continue
+        if key == "result":
+            measurement = value
+        elif key == "error":
+            child.join()
+            raise RuntimeError(f"Stage {name} failed:\n{value}")
+        else:
+            context[key] = value  # Paths later stages need
+    child.join()
+    if child.exitcode:
+        raise RuntimeError(f"Stage {name} failed with exit code {child.exitcode}")
+    seconds = max(measurement["seconds"], 1e-9)
+    measurement["mb_per_s"] = round(measurement["bytes"] / (1024 * 1024) / seconds, 2)
+    measurement["files_per_s"] = round(measurement["files"] / seconds, 1)
+    measurement["seconds"] = round(measurement["seconds"], 4)
+    return measurement
+
+def compare(current, baseline_path):
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    lines = [f"{'stage':<10} {'baseline s':>11} {'current s':>10} {'speedup':>8}"]
+    for name, measurement in current["stages"].items():
+        old = baseline.get("stages", {}).get(name)
+        if old is None:
+            continue
+        speedup = old["seconds"] / max(measurement["seconds"], 1e-9)
+        lines.append(f"{name:<10} {old['seconds']:>11.3f} {measurement['seconds']:>10.3f} {speedup:>7.2f}x")
+    return "\n".join(lines)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--shape", action="append", choices=sorted(SHAPES), help="dataset shape (repeatable, default: all)")
+    parser.add_argument("--scale", type=int, default=1, help="multiplies the size of every shape")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--stage", action="append", choices=[name for name, _ in STAGES], help="only run these stages")
+    parser.add_argument("--level", type=int, default=6, help="gzip level for the compress and backup stages")
+    parser.add_argument("--workers", type=int, default=DEFAULT_COMPRESSION_WORKERS)
+    parser.add_argument("--workdir", help="empty folder to generate data in (default: a temporary folder)")
+    parser.add_argument("--keep", action="store_true", help="keep the generated data")
+    parser.add_argument("--output", help="write the JSON results here instead of stdout")
+    parser.add_argument("--compare", help="previous results file to print speedups against")
+    args = parser.parse_args(argv)
+
+    if args.workdir and Path(args.workdir).is_dir() and any(Path(args.workdir).iterdir()):
+        parser.error(f"--workdir {args.workdir} is not empty")
+    work = Path(args.workdir or tempfile.mkdtemp(prefix="rpm-bench-"))
+    home = work / "home"
+    home.mkdir(parents=True, exist_ok=True)
+    shapes = args.shape or sorted(SHAPES)
+    selected = set(args.stage or [name for name, _ in STAGES])
+    try:
+        dataset = generate_home(home, shapes, args.scale, args.seed)
+        context = {
+            "home": str(home),
+            "work": work,
+            "items": default_backup_items(home),
+            "level": args.level,
+            "workers": args.workers,
+        }
+        stages = {}
+        for name, stage_function in STAGES:
+            # Later stages need the archives earlier ones produce
+            needed = name in selected or (name == "archive" and "compress" in selected) or (name == "backup" and "restore" in selected)
+            if needed:
+                stages[name] = run_stage(name, stage_function, context)
+        for name in set(stages) - selected:
+            del stages[name]
+
+        result = {
+            "version": RESULT_VERSION,
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "shapes": shapes,
+            "scale": args.scale,
+            "workers": args.workers,
+            "level": args.level,
+            "dataset": dataset,
+            "stages": stages,
+        }
+    finally:
+        if not args.keep and args.workdir:
+            for folder in WORK_FOLDERS:
+                shutil.rmtree(work / folder, ignore_errors=True)
+        elif not args.keep:
+            shutil.rmtree(work, ignore_errors=True)
+
+    text = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    if args.compare:
+        print(compare(result, args.compare), file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
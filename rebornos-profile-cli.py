@@ -0,0 +1,458 @@
+#!/usr/bin/env python3
+import os
+import sys
+import json
+import shlex
+import signal
+import argparse
+import subprocess
+from pathlib import Path
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from threading import Event, Thread
+
+from rebornos_profile_engine import (
+    CODEC_GZIP,
+    DAEMON_NICENESS,
+    DEFAULT_COMPRESSION_WORKERS,
+    DEFAULT_EXCLUDE_PATTERNS,
+    DEFAULT_SAVE_LOCATION,
+    EXCLUDED_ITEMS,
+    FORMAT_ARCHIVE,
+    FORMAT_STORE,
+    CATALOG_SORTS,
+    PROGRESS_INTERVAL_MS,
+    BackupAborted,
+    BackupCatalog,
+    BackupSettings,
+    ExclusionRules,
+    Instrumentation,
+    ProgressCounters,
+    available_codecs,
+    default_backup_items,
+    find_unfinished_backup,
+    incremental_chain_length,
+    latest_backup_time,
+    catalog_label,
+    list_backup_contents,
+    lower_priority,
+    read_exclude_file,
+    restore_stream,
+    resume_backup,
+    run_backup,
+    run_restore,
+    run_stream_backup,
+    system_idle,
+    thin_backups,
+    verify_backup,
+)
+
+# Exit codes
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_ABORTED = 130
+
+# Background service timing
+DAEMON_POLL_SECONDS = 60
+DAEMON_RETRY_SECONDS = 15 * 60
+DAEMON_FULL_EVERY = 7  # Incrementals between full backups, so retention can let go of old chains
+
+# Settings a --config file may provide; command-line arguments take precedence
+CONFIG_KEYS = (
+    "items",
+    "exclude",
+    "exclude_patterns",
+    "exclude_from",
+    "max_file_size",
+    "default_excludes",
+    "skip_caches",
+    "backup_dir",
+    "compression",
+    "codec",
+    "level",
+    "workers",
+    "incremental",
+    "full_every",
+    "format",
+    "bandwidth",
+    "every",
+    "idle_load",
+    "nice",
+    "keep_last",
+    "keep_daily",
+    "keep_weekly",
+    "keep_monthly",
+    "report",
+    "profile",
+    "trace",
+)
+
+# Where emit() prints; moved to stderr while the archive itself goes to stdout
+event_output = None
+
+def emit(event, **fields):
+    """Prints one JSON object per line so scripts can follow along."""
+    print(json.dumps({"event": event, **fields}), file=event_output or sys.stdout, flush=True)
+
+@contextmanager
+def open_pipe(target, command, writing):
+    """Yields a binary stream for '-' (stdin/stdout), a path such as a named pipe, or a command's stdin/stdout."""
+    global event_output
+    if command:
+        if writing:
+            process = subprocess.Popen(shlex.split(command), stdin=subprocess.PIPE)
+            stream = process.stdin
+        else:
+            process = subprocess.Popen(shlex.split(command), stdout=subprocess.PIPE)
+            stream = process.stdout
+        broken = False
+        try:
+            yield stream
+        except BrokenPipeError:
+            broken = True  # The command stopped reading; its exit status says why
+        finally:
+            try:
+                stream.close()
+            except BrokenPipeError:
+                broken = True
+            status = process.wait()
+        if status or broken:
+            raise RuntimeError(f"'{command}' exited with status {status}")
+    elif target == "-":
+        if writing:
+            event_output = sys.stderr  # Keep JSON events out of the archive
+            yield sys.stdout.buffer
+        else:
+            yield sys.stdin.buffer
+    else:
+        with open(target, "wb" if writing else "rb") as stream:
+            yield stream
+
+class ProgressPrinter:
+    """Samples ProgressCounters on a fixed interval and prints them as JSON lines."""
+
+    def __init__(self, counters, operation, enabled=True):
+        self.counters = counters
+        self.operation = operation
+        self.enabled = enabled
+        self.stopped = Event()
+        self.thread = Thread(target=self.run, daemon=True)
+
+    def __enter__(self):
+        if self.enabled:
+            self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stopped.set()
+        if self.enabled:
+            self.thread.join()
+            self.print_sample()
+
+    def run(self):
+        while not self.stopped.wait(PROGRESS_INTERVAL_MS / 1000):
+            self.print_sample()
+
+    def print_sample(self):
+        files, num_bytes, fraction, elapsed = self.counters.sample()
+        emit("progress", operation=self.operation, files=files, bytes=num_bytes, fraction=round(fraction, 4), elapsed=round(elapsed, 2))
+
+def load_config(path):
+    with open(path, "r", encoding="utf-8") as f:
+        config = json.load(f)
+    unknown = set(config) - set(CONFIG_KEYS)
+    if unknown:
+        raise ValueError(f"Unknown config keys: {', '.join(sorted(unknown))}")
+    return config
+
+def apply_config(args):
+    """Fills every argument left unset on the command line from the config file, then from defaults."""
+    config = load_config(args.config) if getattr(args, "config", None) else {}
+    defaults = {
+        "items": None,
+        "exclude": [],
+        "exclude_patterns": [],
+        "exclude_from": None,
+        "max_file_size": None,
+        "default_excludes": True,
+        "skip_caches": True,
+        "backup_dir": str(DEFAULT_SAVE_LOCATION),
+        "compression": True,
+        "codec": CODEC_GZIP,
+        "level": None,
+        "workers": DEFAULT_COMPRESSION_WORKERS,
+        "incremental": False,
+        "full_every": DAEMON_FULL_EVERY,
+        "format": FORMAT_ARCHIVE,
+        "bandwidth": None,
+        "every": 24,
+        "idle_load": None,
+        "nice": DAEMON_NICENESS,
+        "keep_last": 0,
+        "keep_daily": 0,
+        "keep_weekly": 0,
+        "keep_monthly": 0,
+        "report": False,
+        "profile": False,
+        "trace": False,
+    }
+    for key, default in defaults.items():
+        if getattr(args, key, None) is None:
+            setattr(args, key, config.get(key, default))
+    return args
+
+def resolve_items(items, home):
+    """Items may be given relative to the home directory, like the BACKUP_ITEMS keys."""
+    return [str(path if path.is_absolute() else home / path) for path in map(Path, items)]
+
+def exclusion_rules(args):
+    patterns = list(DEFAULT_EXCLUDE_PATTERNS) if args.default_excludes else []
+    if args.exclude_from:
+        patterns += read_exclude_file(args.exclude_from)
+    patterns += args.exclude_patterns
+    max_file_size = args.max_file_size * 1024 * 1024 if args.max_file_size else None
+    return ExclusionRules(patterns, max_file_size, args.skip_caches)
+
+def backup_items(args, home):
+    if args.items:
+        return resolve_items(args.items, home)
+    return default_backup_items(home, EXCLUDED_ITEMS + list(args.exclude))
+
+def backup_settings(args):
+    return BackupSettings(
+        save_location=args.backup_dir,
+        compression_enabled=args.compression,
+        codec=args.codec,
+        level=args.level,
+        workers=args.workers,
+        incremental=args.incremental,
+        backup_format=args.format,
+        exclusions=exclusion_rules(args),
+        bandwidth_limit=bandwidth_limit(args),
+    )
+
+def bandwidth_limit(args):
+    return int(args.bandwidth * 1024 * 1024) if args.bandwidth else None
+
+def abort_on_signals():
+    abort_event = Event()
+    signal.signal(signal.SIGINT, lambda signum, frame: abort_event.set())
+    signal.signal(signal.SIGTERM, lambda signum, frame: abort_event.set())
+    return abort_event
+
+def instrumented_progress(args):
+    """ProgressCounters that also carry an Instrumentation when --report, --profile or --trace ask for one."""
+    if args.report or args.profile or args.trace:
+        return ProgressCounters(instruments=Instrumentation(args.profile, args.trace))
+    return ProgressCounters()
+
+def emit_report(progress):
+    if progress.instruments.report_file is not None:
+        emit("report", path=str(progress.instruments.report_file))
+
+def backup_once(args, abort_event, resume, full=False):
+    """Runs or resumes one backup and reports it; raises BackupAborted like run_backup."""
+    home = Path.home()
+    progress = instrumented_progress(args)
+    settings = backup_settings(args)
+    if full:
+        settings.incremental = False
+    with ProgressPrinter(progress, "backup", not args.quiet):
+        if resume:
+            result = resume_backup(args.backup_dir, abort_event, progress, args.workers, bandwidth_limit(args))
+        else:
+            result = run_backup(backup_items(args, home), settings, abort_event, progress, home)
+    emit("done", operation="backup", path=str(result.path), summary=result.summary)
+    emit_report(progress)
+
+def command_backup(args):
+    if args.output or args.output_command:
+        return command_stream_backup(args)
+    backup_once(args, abort_on_signals(), args.resume)
+    return EXIT_OK
+
+def command_stream_backup(args):
+    """Streams one full archive to stdout, a named pipe or a command such as ssh."""
+    if args.resume:
+        raise ValueError("A streamed backup cannot be resumed")
+    home = Path.home()
+    abort_event = abort_on_signals()
+    with open_pipe(args.output, args.output_command, writing=True) as stream:
+        progress = instrumented_progress(args)
+        with ProgressPrinter(progress, "backup", not args.quiet):
+            result = run_stream_backup(backup_items(args, home), stream, backup_settings(args), abort_event, progress, home)
+    emit("done", operation="backup", path=args.output or args.output_command, summary=result.summary)
+    emit_report(progress)
+    return EXIT_OK
+
+def command_daemon(args):
+    """Backs up on a schedule at idle I/O priority, thinning old backups after each run."""
+    ioprio_idle = lower_priority(args.nice)
+    abort_event = abort_on_signals()
+    emit("daemon", state="started", nice=os.nice(0), ioprio_idle=ioprio_idle, every_hours=args.every)
+    while not abort_event.is_set():
+        unfinished = find_unfinished_backup(args.backup_dir)
+        last = latest_backup_time(args.backup_dir)
+        if not (args.once or unfinished or last is None):
+            remaining = (last + timedelta(hours=args.every) - datetime.now()).total_seconds()
+            if remaining > 0:
+                abort_event.wait(min(remaining, DAEMON_POLL_SECONDS))
+                continue
+        if args.idle_load is not None and not system_idle(args.idle_load):
+            emit("daemon", state="waiting_for_idle", load=round(os.getloadavg()[0], 2))
+            abort_event.wait(DAEMON_POLL_SECONDS)
+            continue
+
+        # Incrementals only ever depend on older archives, so a fresh full backup is what lets retention delete a chain
+        full = args.incremental and args.full_every > 0 and incremental_chain_length(args.backup_dir) >= args.full_every
+        try:
+            backup_once(args, abort_event, unfinished is not None, full)
+        except BackupAborted:
+            break  # Stopped by a signal; the partial backup resumes on the next start
+        except Exception as e:
+            emit("error", message=str(e))
+            if args.once:
+                return EXIT_FAILED
+            abort_event.wait(DAEMON_RETRY_SECONDS)
+            continue
+
+        removed = thin_backups(args.backup_dir, args.keep_last, args.keep_daily, args.keep_weekly, args.keep_monthly)
+        if removed:
+            emit("thinned", removed=removed)
+        if args.once:
+            break
+    emit("daemon", state="stopped")
+    return EXIT_OK
+
+def command_restore(args):
+    progress = instrumented_progress(args)
+    if args.input or args.input_command:
+        with open_pipe(args.input, args.input_command, writing=False) as stream:
+            with ProgressPrinter(progress, "restore", not args.quiet):
+                restore_stream(stream, args.destination, set(args.paths) or None, progress)
+        emit("done", operation="restore", backup=args.input or args.input_command)
+        emit_report(progress)
+        return EXIT_OK
+    if args.backup is None:
+        raise ValueError("Give a backup id, --input or --input-command")
+    with ProgressPrinter(progress, "restore", not args.quiet):
+        run_restore(args.backup, args.backup_dir, args.destination, set(args.paths) or None, progress)
+    emit("done", operation="restore", backup=args.backup)
+    emit_report(progress)
+    return EXIT_OK
+
+def command_list(args):
+    with BackupCatalog(args.backup_dir) as catalog:
+        catalog.refresh()
+        entries = catalog.query(args.sort, args.search)
+    for fields in entries:
+        fields["label"] = catalog_label(fields)
+        if args.contents:
+            fields["contents"] = [{"path": name, "size": size} for name, size in list_backup_contents(fields["id"], args.backup_dir)]
+        emit("backup", **fields)
+    return EXIT_OK
+
+def command_verify(args):
+    progress = ProgressCounters()
+    with ProgressPrinter(progress, "verify", not args.quiet):
+        problems = verify_backup(args.backup, args.backup_dir, progress, args.workers)
+    for problem in problems:
+        emit("problem", backup=args.backup, message=problem)
+    emit("done", operation="verify", backup=args.backup, ok=not problems)
+    return EXIT_OK if not problems else EXIT_FAILED
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="rebornos-profile-cli",
+        description="Back up and restore profile data without a display. Output is one JSON object per line.",
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    def add_common(subparser):
+        subparser.add_argument("--config", help="JSON file with default settings (keys: " + ", ".join(CONFIG_KEYS) + ")")
+        subparser.add_argument("--backup-dir", dest="backup_dir", help=f"folder holding the backups (default: {DEFAULT_SAVE_LOCATION})")
+        subparser.add_argument("-q", "--quiet", action="store_true", help="do not print progress events")
+
+    def add_report_options(subparser):
+        subparser.add_argument("--report", action="store_true", default=None, help="save a JSON run report with stage timings, counters and the slowest files (next to the archive, or in the cache folder)")
+        subparser.add_argument("--profile", action="store_true", default=None, help="also profile every thread with cProfile (implies --report)")
+        subparser.add_argument("--trace", action="store_true", default=None, help="also record stage timings as a Chrome trace for Perfetto (implies --report)")
+
+    def add_backup_options(backup):
+        backup.add_argument("--item", dest="items", action="append", help="file or folder to back up, relative to $HOME (repeatable; default: BACKUP_ITEMS)")
+        backup.add_argument("--exclude", action="append", help="folder name to leave out of recursive items (repeatable)")
+        backup.add_argument("--exclude-pattern", dest="exclude_patterns", action="append", help="gitignore-style pattern relative to $HOME, e.g. '*.iso' or '.local/share/Steam/' (repeatable)")
+        backup.add_argument("--exclude-from", help="file with one gitignore-style pattern per line")
+        backup.add_argument("--max-file-size", type=int, help="skip files larger than this many MiB")
+        backup.add_argument("--no-default-excludes", dest="default_excludes", action="store_false", default=None, help="also back up caches, trash and node_modules")
+        backup.add_argument("--include-caches", dest="skip_caches", action="store_false", default=None, help="enter folders tagged with CACHEDIR.TAG")
+        backup.add_argument("--no-compression", dest="compression", action="store_false", default=None, help="write a plain .tar")
+        backup.add_argument("--codec", choices=available_codecs())
+        backup.add_argument("--level", type=int)
+        backup.add_argument("--workers", type=int)
+        backup.add_argument("--incremental", action="store_true", default=None, help="only store changes since the last backup")
+        backup.add_argument("--format", choices=[FORMAT_ARCHIVE, FORMAT_STORE])
+        backup.add_argument("--bandwidth", type=float, help="read source files at no more than this many MiB/s")
+
+    backup = subparsers.add_parser("backup", help="create a backup")
+    add_common(backup)
+    add_backup_options(backup)
+    add_report_options(backup)
+    backup.add_argument("--resume", action="store_true", help="continue the newest interrupted backup in --backup-dir from its last checkpoint")
+    output = backup.add_mutually_exclusive_group()
+    output.add_argument("--output", help="stream a full archive here instead of --backup-dir: '-' for stdout, or a path such as a named pipe")
+    output.add_argument("--output-command", help="stream a full archive into this command's stdin, e.g. \"ssh host 'cat > home.tar.gz'\"")
+    backup.set_defaults(handler=command_backup)
+
+    daemon = subparsers.add_parser("daemon", help="back up on a schedule in the background, e.g. as a systemd user service")
+    add_common(daemon)
+    add_backup_options(daemon)
+    add_report_options(daemon)
+    daemon.add_argument("--every", type=float, help="hours between backups, counted from the newest backup (default: 24)")
+    daemon.add_argument("--idle-load", type=float, help="only start when the 1-minute load average is at or below this")
+    daemon.add_argument("--nice", type=int, help=f"CPU niceness to run at (default: {DAEMON_NICENESS}); I/O always uses the idle class")
+    daemon.add_argument("--once", action="store_true", help="run one backup now and exit, for use from a systemd timer")
+    daemon.add_argument("--full-every", type=int, help=f"with --incremental, make a full backup after this many incrementals (default: {DAEMON_FULL_EVERY}; 0 never)")
+    for period in ("last", "daily", "weekly", "monthly"):
+        daemon.add_argument(f"--keep-{period}", dest=f"keep_{period}", type=int, help=f"retention: how many {period} backups to keep (default: keep all)")
+    daemon.set_defaults(handler=command_daemon)
+
+    restore = subparsers.add_parser("restore", help="restore a backup")
+    add_common(restore)
+    restore.add_argument("backup", nargs="?", help="backup id as printed by 'list'")
+    source = restore.add_mutually_exclusive_group()
+    source.add_argument("--input", help="read a streamed archive from here instead: '-' for stdin, or a path such as a named pipe")
+    source.add_argument("--input-command", help="read a streamed archive from this command's stdout, e.g. \"ssh host 'cat home.tar.gz'\"")
+    restore.add_argument("--path", dest="paths", action="append", default=[], help="only restore this path (repeatable)")
+    restore.add_argument("--destination", default=str(Path.home()), help="folder to restore into (default: $HOME)")
+    add_report_options(restore)
+    restore.set_defaults(handler=command_restore)
+
+    list_parser = subparsers.add_parser("list", help="list backups")
+    add_common(list_parser)
+    list_parser.add_argument("--contents", action="store_true", help="include each backup's file list")
+    list_parser.add_argument("--sort", choices=list(CATALOG_SORTS), default="newest")
+    list_parser.add_argument("--search", help="only list backups whose name or items contain this text")
+    list_parser.set_defaults(handler=command_list)
+
+    verify = subparsers.add_parser("verify", help="read a backup back and check its checksums")
+    add_common(verify)
+    verify.add_argument("backup", help="backup id as printed by 'list'")
+    verify.add_argument("--workers", type=int, help="threads re-hashing the backup (default: one per core)")
+    verify.set_defaults(handler=command_verify)
+
+    return parser
+
+def main(argv=None):
+    args = apply_config(build_parser().parse_args(argv))
+    try:
+        return args.handler(args)
+    except BackupAborted as e:
+        emit("aborted", message=str(e))
+        return EXIT_ABORTED
+    except Exception as e:
+        emit("error", message=str(e))
+        return EXIT_FAILED
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,13 +1,47 @@
 #!/usr/bin/env python3
 import gi
-import os
-import tarfile
+import time
 from pathlib import Path
-from datetime import datetime
 from threading import Thread, Event
+import queue
 
 gi.require_version("Gtk", "3.0")
-from gi.repository import Gtk, GdkPixbuf, GLib
+from gi.repository import Gtk, GdkPixbuf, GLib, Gio
+
+from rebornos_profile_engine import (
+    BACKUP_ITEMS,
+    CATALOG_SORTS,
+    CODEC_GZIP,
+    CODEC_LEVELS,
+    DEFAULT_COMPRESSION_WORKERS,
+    DEFAULT_EXCLUDE_PATTERNS,
+    DEFAULT_SAVE_LOCATION,
+    FORMAT_ARCHIVE,
+    FORMAT_STORE,
+    PROGRESS_INTERVAL_MS,
+    STORE_DIRNAME,
+    BackupAborted,
+    BackupCatalog,
+    BackupSettings,
+    ChunkStore,
+    ExclusionRules,
+    FolderSizeCache,
+    Instrumentation,
+    ProgressCounters,
+    available_codecs,
+    catalog_label,
+    debug_print,
+    directory_size,
+    discard_unfinished_backup,
+    find_unfinished_backup,
+    format_size,
+    list_backup_contents,
+    list_subdirectories,
+    resume_backup,
+    run_backup,
+    run_restore,
+    verify_backup,
+)
 
 # Constants
 LOGO_PATH = "/usr/share/pixmaps/rebornos.svg"
@@ -15,32 +49,53 @@ OPERATION_BACKUP = "backup"
 OPERATION_RESTORE = "restore"
 COLOR_ABORT = "red"
 COLOR_START = "green"
-
-# Backup Items
-BACKUP_ITEMS = {
-    ".bashrc": None,
-    ".bash_profile": None,
-    ".ssh": None,
-    ".gnupg": None,
-    ".profile": None,
-    ".config": "recursive",
-    ".local": "recursive",
-    "Documents": None,
-    "Pictures": None,
-}
-
-EXCLUDED_ITEMS = [
-    "gtk-2.0",
-    "gtk-3.0",
-    "some_file"
-]
-
-# Some simple debugging
-DEBUG_MODE = False
-
-def debug_print(message):
-    if DEBUG_MODE:
-        print(message)
+PROGRESS_RATE_SMOOTHING = 0.3
+CATALOG_REFRESH_DELAY_MS = 500
+
+# Folder tree columns
+TREE_COLUMN_NAME = 0
+TREE_COLUMN_ACTIVE = 1
+TREE_COLUMN_PATH = 2
+TREE_COLUMN_SIZE = 3
+
+class ProgressReporter:
+    """Publishes ProgressCounters to a progress bar from a fixed-rate GLib timer.
+
+    Workers never queue UI callbacks per file, so reporting cost stays flat
+    however many files a backup or restore touches.
+    """
+
+    def __init__(self, counters, update, interval_ms=PROGRESS_INTERVAL_MS):
+        self.counters = counters
+        self.update = update
+        self.last_sample = (0, 0, 0.0)
+        self.files_rate = 0.0
+        self.bytes_rate = 0.0
+        self.source_id = GLib.timeout_add(interval_ms, self.tick)
+
+    def tick(self):
+        started = time.perf_counter()
+        files, num_bytes, fraction, elapsed = self.counters.sample()
+        last_files, last_bytes, last_elapsed = self.last_sample
+        interval = elapsed - last_elapsed
+        if interval > 0:
+            # Smooth the instantaneous rates so the readout does not jitter
+            self.files_rate += PROGRESS_RATE_SMOOTHING * ((files - last_files) / interval - self.files_rate)
+            self.bytes_rate += PROGRESS_RATE_SMOOTHING * ((num_bytes - last_bytes) / interval - self.bytes_rate)
+        self.last_sample = (files, num_bytes, elapsed)
+
+        text = f"{int(fraction * 100)}% · {self.files_rate:.0f} files/s · {self.bytes_rate / (1024 * 1024):.1f} MB/s"
+        if 0 < fraction < 1:
+            remaining = int(elapsed * (1 - fraction) / fraction)
+            text += f" · ETA {remaining // 60}:{remaining % 60:02d}"
+        self.update(fraction, text)
+        self.counters.instruments.add_time("ui update", started)  # GTK main loop time spent on progress
+        return True
+
+    def stop(self):
+        if self.source_id is not None:
+            GLib.source_remove(self.source_id)
+            self.source_id = None
 
 class RebornProfileManager(Gtk.Window):
     def __init__(self):
@@ -48,15 +103,39 @@ class RebornProfileManager(Gtk.Window):
         self.set_default_size(600, 400)
 
         # Default settings
-        self.default_save_location = Path.home() / "Downloads"
+        self.default_save_location = DEFAULT_SAVE_LOCATION
         self.compression_enabled = True
+        self.incremental_enabled = False
+        self.backup_format = FORMAT_ARCHIVE
+        self.snapshots_to_keep = 10
+        self.compression_codec = CODEC_GZIP
+        self.compression_level = CODEC_LEVELS[CODEC_GZIP][2]
+        self.compression_workers = DEFAULT_COMPRESSION_WORKERS
+        self.default_excludes_enabled = True
+        self.skip_caches = True
+        self.exclude_patterns = []
+        self.max_file_size_mb = 0
+        self.reports_enabled = False
 
         self.backup_in_progress = False
+        self.prune_in_progress = False
         self.abort_event = Event()
+        self.progress_reporters = {}
+
+        # Backup catalog for the Restore tab, kept in sync by watching the backup folder
+        self.catalog = None
+        self.catalog_sort = "newest"
+        self.folder_monitors = []
+        self.catalog_refresh_source = None
 
         # Track selected recursive items
         self.selected_recursive_items = set()
 
+        # Folder sizes are computed on a background worker and cached between launches
+        self.folder_sizes = FolderSizeCache()
+        self.folder_size_queue = queue.Queue()
+        Thread(target=self.folder_size_worker, daemon=True).start()
+
         # Main container with padding
         self.main_box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=10)
         self.main_box.set_margin_top(10)
@@ -121,24 +200,30 @@ class RebornProfileManager(Gtk.Window):
                     label = Gtk.Label(label=f"{item}/")
                     frame_box.pack_start(label, False, False, 0)    
 
-                    # Create TreeStore
-                    tree_store = Gtk.TreeStore(str, bool)
+                    # Create TreeStore: name, include, full path, size
+                    tree_store = Gtk.TreeStore(str, bool, str, str)
                     tree_view = Gtk.TreeView(model=tree_store)  
+                    tree_view.connect("row-expanded", self.on_tree_row_expanded, tree_store)
 
                     # Add toggle column
                     toggle_renderer = Gtk.CellRendererToggle()
                     toggle_renderer.set_activatable(True)
                     toggle_renderer.connect("toggled", self.on_tree_item_toggled, tree_store, item)
-                    toggle_column = Gtk.TreeViewColumn("Include", toggle_renderer, active=1)
+                    toggle_column = Gtk.TreeViewColumn("Include", toggle_renderer, active=TREE_COLUMN_ACTIVE)
                     tree_view.append_column(toggle_column)  
 
                     # Add name column
                     text_renderer = Gtk.CellRendererText()
-                    name_column = Gtk.TreeViewColumn("Name", text_renderer, text=0)
+                    name_column = Gtk.TreeViewColumn("Name", text_renderer, text=TREE_COLUMN_NAME)
+                    name_column.set_expand(True)
                     tree_view.append_column(name_column)    
 
-                    # Populate tree and initialize selected items
-                    self.populate_tree_store(tree_store, full_path, item)   
+                    # Add size column
+                    size_column = Gtk.TreeViewColumn("Size", Gtk.CellRendererText(), text=TREE_COLUMN_SIZE)
+                    tree_view.append_column(size_column)
+
+                    # Populate the top level in the background; deeper levels load on expand
+                    self.populate_tree_store(tree_store, full_path, None)   
 
                     scrolled_window = Gtk.ScrolledWindow()
                     scrolled_window.add(tree_view)
@@ -162,21 +247,70 @@ class RebornProfileManager(Gtk.Window):
         self.backup_button = self.create_button("Start Backup", "backup-button", backup_box)
         self.backup_button.connect("clicked", self.on_backup_button_clicked)
 
-    def populate_tree_store(self, tree_store, path, root_key):
-        for sub_item in sorted(path.iterdir()):
-            if sub_item.is_dir() and sub_item.name not in EXCLUDED_ITEMS:
-                full_path = str(sub_item)
-                display_name = sub_item.name  # Show just the folder name in the tree view
-                tree_store.append(None, [display_name, False])  # Default to unchecked
+        # Offered only while an interrupted backup is waiting in the backup folder
+        self.resume_button = self.create_button("Resume Unfinished Backup", None, backup_box)
+        self.resume_button.connect("clicked", self.on_resume_button_clicked)
+        self.resume_button.set_no_show_all(True)
+        self.update_resume_button()
+
+    def populate_tree_store(self, tree_store, path, parent_ref):
+        Thread(target=self.load_tree_children, args=(tree_store, str(path), parent_ref), daemon=True).start()
+
+    def load_tree_children(self, tree_store, path, parent_ref):
+        children = list_subdirectories(path)
+        GLib.idle_add(self.append_tree_children, tree_store, parent_ref, children)
+
+    def append_tree_children(self, tree_store, parent_ref, children):
+        if parent_ref is None:
+            parent_iter = None
+            parent_active = False
+        else:
+            if not parent_ref.valid():
+                return
+            parent_iter = tree_store.get_iter(parent_ref.get_path())
+            parent_active = tree_store[parent_iter][TREE_COLUMN_ACTIVE]
+            placeholder = tree_store.iter_children(parent_iter)
+            if placeholder is not None:
+                tree_store.remove(placeholder)
+
+        for name, path in children:
+            cached_size = self.folder_sizes.get(path)
+            size_text = format_size(cached_size) if cached_size is not None else "…"
+            child_iter = tree_store.append(parent_iter, [name, parent_active, path, size_text])
+            # Placeholder row so the expander shows; replaced when the row is first expanded
+            tree_store.append(child_iter, ["Loading…", False, "", ""])
+            row_ref = Gtk.TreeRowReference.new(tree_store, tree_store.get_path(child_iter))
+            self.folder_size_queue.put((tree_store, row_ref, path))
+
+    def on_tree_row_expanded(self, tree_view, tree_iter, tree_path, tree_store):
+        first_child = tree_store.iter_children(tree_iter)
+        if first_child is None or tree_store[first_child][TREE_COLUMN_PATH] != "":
+            return  # Already loaded
+        tree_store[first_child][TREE_COLUMN_PATH] = None  # Mark as loading so it is only requested once
+        row_ref = Gtk.TreeRowReference.new(tree_store, tree_path)
+        self.populate_tree_store(tree_store, tree_store[tree_iter][TREE_COLUMN_PATH], row_ref)
+
+    def folder_size_worker(self):
+        while True:
+            tree_store, row_ref, path = self.folder_size_queue.get()
+            size = directory_size(path)
+            self.folder_sizes.set(path, size)
+            GLib.idle_add(self.set_tree_row_size, tree_store, row_ref, size)
+            if self.folder_size_queue.empty():
+                self.folder_sizes.save()
+
+    def set_tree_row_size(self, tree_store, row_ref, size):
+        if row_ref.valid():
+            tree_store[row_ref.get_path()][TREE_COLUMN_SIZE] = format_size(size)
 
     def on_tree_item_toggled(self, widget, path, tree_store, root_key):
         tree_iter = tree_store.get_iter(path)
-        current_value = tree_store[tree_iter][1]
-        tree_store[tree_iter][1] = not current_value  # Toggle the checkbox state   
+        if not tree_store[tree_iter][TREE_COLUMN_PATH]:
+            return  # Placeholder row
+        current_value = tree_store[tree_iter][TREE_COLUMN_ACTIVE]
+        tree_store[tree_iter][TREE_COLUMN_ACTIVE] = not current_value  # Toggle the checkbox state   
 
-        # Retrieve folder name and map it to the full path
-        folder_name = tree_store[tree_iter][0]
-        full_path = str(Path.home() / root_key / folder_name)   
+        full_path = tree_store[tree_iter][TREE_COLUMN_PATH]
 
         if not current_value:
             self.selected_recursive_items.add(full_path)  # Add full path to set
@@ -191,10 +325,38 @@ class RebornProfileManager(Gtk.Window):
 
         # Dropdown and Progress
         label = self.create_label("Select Backup to Restore:", restore_box)
+        filter_box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=10)
+        self.search_entry = Gtk.SearchEntry()
+        self.search_entry.set_placeholder_text("Filter by name or item")
+        self.search_entry.connect("search-changed", self.on_catalog_filter_changed)
+        filter_box.pack_start(self.search_entry, True, True, 0)
+        self.sort_combo = Gtk.ComboBoxText()
+        for sort in CATALOG_SORTS:
+            self.sort_combo.append(sort, sort.capitalize())
+        self.sort_combo.set_active_id(self.catalog_sort)
+        self.sort_combo.connect("changed", self.on_catalog_sort_changed)
+        filter_box.pack_start(self.sort_combo, False, False, 0)
+        restore_box.pack_start(filter_box, False, False, 0)
+
         self.profile_dropdown = Gtk.ComboBoxText()
-        self.populate_restore_dropdown()
+        self.open_catalog()
+        self.profile_dropdown.connect("changed", self.on_profile_changed)
         self.safe_repack_widget(restore_box, self.profile_dropdown, False, False, 0) 
 
+        # Backup contents, read from the sidecar index so listing never touches the archive
+        self.contents_store = Gtk.ListStore(bool, str, str)
+        contents_view = Gtk.TreeView(model=self.contents_store)
+        toggle_renderer = Gtk.CellRendererToggle()
+        toggle_renderer.set_activatable(True)
+        toggle_renderer.connect("toggled", self.on_contents_item_toggled)
+        contents_view.append_column(Gtk.TreeViewColumn("Restore", toggle_renderer, active=0))
+        contents_view.append_column(Gtk.TreeViewColumn("Path", Gtk.CellRendererText(), text=1))
+        contents_view.append_column(Gtk.TreeViewColumn("Size", Gtk.CellRendererText(), text=2))
+        contents_window = Gtk.ScrolledWindow()
+        contents_window.add(contents_view)
+        self.create_label("Leave all paths unchecked to restore everything:", restore_box)
+        restore_box.pack_start(contents_window, True, True, 0)
+
         # Add Refresh Button
         self.refresh_button = self.create_button("Refresh List", None, restore_box)
         self.refresh_button.connect("clicked", self.on_refresh_button_clicked)
@@ -210,6 +372,10 @@ class RebornProfileManager(Gtk.Window):
         self.restore_button.connect("clicked", self.on_restore_button_clicked)
         self.safe_repack_widget(restore_box, self.restore_button, False, False, 0)
 
+        # Verify Button
+        self.verify_button = self.create_button("Verify Backup", None, restore_box)
+        self.verify_button.connect("clicked", self.on_verify_button_clicked)
+
     def create_settings_tab(self):
         settings_box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=10)
         self.notebook.append_page(settings_box, Gtk.Label(label="Settings"))
@@ -231,6 +397,97 @@ class RebornProfileManager(Gtk.Window):
         compression_toggle.connect("toggled", self.on_toggle_compression)
         settings_box.pack_start(compression_toggle, False, False, 0)
 
+        # Backup Format
+        format_frame = Gtk.Frame(label="Backup Format")
+        format_box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=6)
+        format_frame.add(format_box)
+        settings_box.pack_start(format_frame, False, False, 0)
+
+        format_dropdown = Gtk.ComboBoxText()
+        format_dropdown.append(FORMAT_ARCHIVE, "Archive (one tar file per backup)")
+        format_dropdown.append(FORMAT_STORE, "Deduplicating store (shared chunks, small snapshots)")
+        format_dropdown.set_active_id(self.backup_format)
+        format_dropdown.connect("changed", self.on_format_changed)
+        format_box.pack_start(format_dropdown, False, False, 0)
+
+        prune_box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=10)
+        prune_box.pack_start(Gtk.Label(label="Snapshots to keep:"), False, False, 0)
+        keep_spin = Gtk.SpinButton.new_with_range(1, 1000, 1)
+        keep_spin.set_value(self.snapshots_to_keep)
+        keep_spin.connect("value-changed", self.on_snapshots_to_keep_changed)
+        prune_box.pack_start(keep_spin, False, False, 0)
+        prune_button = self.create_button("Prune Snapshots", None, prune_box)
+        prune_button.connect("clicked", self.on_prune_button_clicked)
+        format_box.pack_start(prune_box, False, False, 0)
+
+        # Compression Options
+        compression_frame = Gtk.Frame(label="Compression Options")
+        compression_grid = Gtk.Grid(column_spacing=10, row_spacing=6)
+        compression_frame.add(compression_grid)
+        settings_box.pack_start(compression_frame, False, False, 0)
+
+        self.codec_dropdown = Gtk.ComboBoxText()
+        for codec in available_codecs():
+            self.codec_dropdown.append(codec, codec)
+        self.codec_dropdown.set_active_id(self.compression_codec)
+        self.codec_dropdown.connect("changed", self.on_codec_changed)
+        compression_grid.attach(Gtk.Label(label="Codec:", xalign=0), 0, 0, 1, 1)
+        compression_grid.attach(self.codec_dropdown, 1, 0, 1, 1)
+
+        low, high, _ = CODEC_LEVELS[self.compression_codec]
+        self.level_spin = Gtk.SpinButton.new_with_range(low, high, 1)
+        self.level_spin.set_value(self.compression_level)
+        self.level_spin.connect("value-changed", self.on_level_changed)
+        compression_grid.attach(Gtk.Label(label="Level:", xalign=0), 0, 1, 1, 1)
+        compression_grid.attach(self.level_spin, 1, 1, 1, 1)
+
+        workers_spin = Gtk.SpinButton.new_with_range(1, max(DEFAULT_COMPRESSION_WORKERS, 1) * 2, 1)
+        workers_spin.set_value(self.compression_workers)
+        workers_spin.connect("value-changed", self.on_workers_changed)
+        compression_grid.attach(Gtk.Label(label="Worker Threads:", xalign=0), 0, 2, 1, 1)
+        compression_grid.attach(workers_spin, 1, 2, 1, 1)
+
+        # Incremental Toggle
+        incremental_toggle = Gtk.CheckButton(label="Incremental Backups (only store changes since the last backup)")
+        incremental_toggle.set_active(self.incremental_enabled)
+        incremental_toggle.connect("toggled", self.on_toggle_incremental)
+        settings_box.pack_start(incremental_toggle, False, False, 0)
+
+        # Exclusions, applied while scanning so skipped folders are never entered
+        exclusions_frame = Gtk.Frame(label="Exclusions")
+        exclusions_grid = Gtk.Grid(column_spacing=10, row_spacing=6)
+        exclusions_frame.add(exclusions_grid)
+        settings_box.pack_start(exclusions_frame, False, False, 0)
+
+        default_excludes_toggle = Gtk.CheckButton(label="Skip caches, trash and node_modules")
+        default_excludes_toggle.set_active(self.default_excludes_enabled)
+        default_excludes_toggle.connect("toggled", self.on_toggle_default_excludes)
+        exclusions_grid.attach(default_excludes_toggle, 0, 0, 2, 1)
+
+        cachedir_toggle = Gtk.CheckButton(label="Skip folders tagged with CACHEDIR.TAG")
+        cachedir_toggle.set_active(self.skip_caches)
+        cachedir_toggle.connect("toggled", self.on_toggle_skip_caches)
+        exclusions_grid.attach(cachedir_toggle, 0, 1, 2, 1)
+
+        patterns_entry = Gtk.Entry()
+        patterns_entry.set_placeholder_text("*.iso, .local/share/Steam/")
+        patterns_entry.connect("changed", self.on_exclude_patterns_changed)
+        patterns_entry.set_hexpand(True)
+        exclusions_grid.attach(Gtk.Label(label="Extra Patterns:", xalign=0), 0, 2, 1, 1)
+        exclusions_grid.attach(patterns_entry, 1, 2, 1, 1)
+
+        max_size_spin = Gtk.SpinButton.new_with_range(0, 1024 * 1024, 100)
+        max_size_spin.set_value(self.max_file_size_mb)
+        max_size_spin.connect("value-changed", self.on_max_file_size_changed)
+        exclusions_grid.attach(Gtk.Label(label="Skip Files Larger Than (MB, 0 = no limit):", xalign=0), 0, 3, 1, 1)
+        exclusions_grid.attach(max_size_spin, 1, 3, 1, 1)
+
+        # Run reports, for finding out where a slow backup or restore spends its time
+        reports_toggle = Gtk.CheckButton(label="Save a performance report with each backup and restore")
+        reports_toggle.set_active(self.reports_enabled)
+        reports_toggle.connect("toggled", self.on_toggle_reports)
+        settings_box.pack_start(reports_toggle, False, False, 0)
+
     def create_toggle(self, label, container):
         toggle = Gtk.CheckButton(label=label)
         toggle.set_active(True)
@@ -259,6 +516,8 @@ class RebornProfileManager(Gtk.Window):
             debug_print("Backup aborted by user.")
             self.abort_event.set()
             self.reset_backup_state()
+        elif self.prune_in_progress:
+            self.show_message_dialog("Error", "Cannot start a backup while snapshots are being pruned!")
         else:
             # Collect non-recursive items
             selected_items = [
@@ -279,92 +538,99 @@ class RebornProfileManager(Gtk.Window):
                 self.show_message_dialog("Error", "No items selected for backup!")
                 return  
 
+            unfinished = find_unfinished_backup(self.default_save_location)
+            if unfinished is not None:
+                dialog = Gtk.MessageDialog(
+                    parent=self,
+                    flags=Gtk.DialogFlags.MODAL,
+                    type=Gtk.MessageType.QUESTION,
+                    buttons=Gtk.ButtonsType.YES_NO,
+                    message_format=f"An unfinished backup ({unfinished.name}) can still be resumed. Discard it and start a new backup?",
+                )
+                response = dialog.run()
+                dialog.destroy()
+                if response != Gtk.ResponseType.YES:
+                    return
+                discard_unfinished_backup(unfinished)
+
             self.abort_event.clear()
             self.backup_in_progress = True
             self.update_backup_button("Abort", COLOR_ABORT)
             self.spinner.start()
             Thread(target=self.perform_backup, args=(selected_items,), daemon=True).start()
 
-    def get_checked_recursive_items(self, tree_store, root_key):
+    def on_resume_button_clicked(self, widget):
+        if self.backup_in_progress or self.prune_in_progress:
+            return
+        self.abort_event.clear()
+        self.backup_in_progress = True
+        self.update_backup_button("Abort", COLOR_ABORT)
+        self.update_resume_button()
+        self.spinner.start()
+        Thread(target=self.perform_backup, args=(None, True), daemon=True).start()
+
+    def update_resume_button(self):
+        resumable = not self.backup_in_progress and find_unfinished_backup(self.default_save_location) is not None
+        self.resume_button.set_visible(resumable)
+
+    def get_checked_recursive_items(self, tree_store, root_key, parent_iter=None):
         checked_items = []
-        tree_iter = tree_store.get_iter_first() 
+        tree_iter = tree_store.iter_children(parent_iter)
 
         while tree_iter:
-            if tree_store[tree_iter][1]:  # If checked
-                folder_name = tree_store[tree_iter][0]
-                full_path = str(Path.home() / root_key / folder_name)
-                checked_items.append(full_path)
-            tree_iter = tree_store.iter_next(tree_iter) 
+            full_path = tree_store[tree_iter][TREE_COLUMN_PATH]
+            if full_path and tree_store[tree_iter][TREE_COLUMN_ACTIVE]:  # If checked
+                checked_items.append(full_path)  # Includes everything below, so skip the children
+            elif full_path:
+                checked_items.extend(self.get_checked_recursive_items(tree_store, root_key, tree_iter))
+            tree_iter = tree_store.iter_next(tree_iter)
 
         return checked_items
 
-    def perform_backup(self, items):
-        # Ensure the default save location exists
-        if not self.default_save_location.exists():
-            try:
-                self.default_save_location.mkdir(parents=True, exist_ok=True)
-                debug_print(f"Created default save location: {self.default_save_location}")
-            except Exception as e:
-                GLib.idle_add(self.show_message_dialog, "Error", f"Failed to create default save location: {str(e)}")
-                GLib.idle_add(self.reset_backup_state)
-                return
+    def backup_settings(self):
+        return BackupSettings(
+            save_location=self.default_save_location,
+            compression_enabled=self.compression_enabled,
+            codec=self.compression_codec,
+            level=self.compression_level,
+            workers=self.compression_workers,
+            incremental=self.incremental_enabled,
+            backup_format=self.backup_format,
+            exclusions=ExclusionRules(
+                (DEFAULT_EXCLUDE_PATTERNS if self.default_excludes_enabled else []) + self.exclude_patterns,
+                self.max_file_size_mb * 1024 * 1024,
+                self.skip_caches,
+            ),
+        )
 
-        timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-        file_extension = "tar.gz" if self.compression_enabled else "tar"
-        backup_file = self.default_save_location / f"profile_backup_{timestamp}.{file_extension}"   
+    def new_progress(self):
+        return ProgressCounters(instruments=Instrumentation() if self.reports_enabled else None)
 
+    def perform_backup(self, items, resume=False):
+        progress = self.new_progress()
+        GLib.idle_add(self.start_progress_reporter, progress, OPERATION_BACKUP)
         try:
-            mode = "w:gz" if self.compression_enabled else "w"
-            total_files = self.count_files(items)
-            processed_files = 0 
-
-            with tarfile.open(backup_file, mode) as tar:
-                for item in items:
-                    if self.abort_event.is_set():
-                        debug_print("Backup aborted by user.")
-                        GLib.idle_add(self.show_message_dialog, "Aborted", "Backup was aborted!")
-                        GLib.idle_add(self.reset_backup_state)
-                        if backup_file.exists():  # Remove the incomplete tar file
-                            backup_file.unlink()
-                        return  
-
-                    full_path = Path(item)
-                    if not full_path.exists():
-                        debug_print(f"Skipping non-existent item: {item}")
-                        continue    
-
-                    if full_path.is_dir():
-                        for root, _, files in os.walk(full_path):
-                            for file in files:
-                                if self.abort_event.is_set():
-                                    debug_print("Backup aborted mid-process.")
-                                    GLib.idle_add(self.show_message_dialog, "Aborted", "Backup was aborted!")
-                                    GLib.idle_add(self.reset_backup_state)
-                                    if backup_file.exists():  # Remove the incomplete tar file
-                                        backup_file.unlink()
-                                    return
-                                file_path = os.path.join(root, file)
-                                tar.add(file_path, arcname=os.path.relpath(file_path, Path.home()))
-                                processed_files += 1
-                                GLib.idle_add(self.update_progress_bar, processed_files / total_files, OPERATION_BACKUP)
-                    elif full_path.is_file():
-                        tar.add(full_path, arcname=os.path.basename(item))
-                        processed_files += 1
-                        GLib.idle_add(self.update_progress_bar, processed_files / total_files, OPERATION_BACKUP)    
-
-            GLib.idle_add(self.show_message_dialog, "Success", f"Backup completed: {backup_file}")
+            if resume:
+                result = resume_backup(self.default_save_location, self.abort_event, progress, self.compression_workers)
+            else:
+                result = run_backup(items, self.backup_settings(), self.abort_event, progress)
+            GLib.idle_add(self.open_catalog)  # The first snapshot creates a folder to watch
+            GLib.idle_add(self.show_message_dialog, "Success", result.summary)
+        except BackupAborted as e:
+            GLib.idle_add(self.show_message_dialog, "Aborted", str(e))
         except Exception as e:
             debug_print(f"Error during backup: {e}")
             GLib.idle_add(self.show_message_dialog, "Error", f"Backup failed: {str(e)}")
         finally:
             GLib.idle_add(self.reset_backup_state)
 
-
     def reset_backup_state(self):
+        self.stop_progress_reporter(OPERATION_BACKUP)
         self.backup_in_progress = False
         self.spinner.stop()
         self.update_progress_bar(0.0, OPERATION_BACKUP)
         self.update_backup_button("Start Backup", COLOR_START)
+        self.update_resume_button()
 
     def update_backup_button(self, label, color):
         self.backup_button.set_label(label)
@@ -382,17 +648,54 @@ class RebornProfileManager(Gtk.Window):
         style_context.add_provider(css_provider, Gtk.STYLE_PROVIDER_PRIORITY_APPLICATION)
         style_context.add_class("backup-button")
 
-    def update_progress_bar(self, fraction, operation):
+    def update_progress_bar(self, fraction, operation, text=None):
         bar = self.progress_bar if operation == OPERATION_BACKUP else self.restore_progress_bar
         bar.set_fraction(fraction)
-        bar.set_text(f"{int(fraction * 100)}%")
+        bar.set_text(text or f"{int(fraction * 100)}%")
         bar.set_show_text(True)
 
+    def start_progress_reporter(self, counters, operation):
+        self.stop_progress_reporter(operation)
+        self.progress_reporters[operation] = ProgressReporter(
+            counters, lambda fraction, text: self.update_progress_bar(fraction, operation, text)
+        )
+
+    def stop_progress_reporter(self, operation):
+        reporter = self.progress_reporters.pop(operation, None)
+        if reporter is not None:
+            reporter.tick()  # Show the final numbers
+            reporter.stop()
+
+    def on_profile_changed(self, widget):
+        self.contents_store.clear()
+        profile = self.profile_dropdown.get_active_id()
+        if profile:
+            Thread(target=self.load_backup_contents, args=(profile,), daemon=True).start()
+
+    def load_backup_contents(self, profile):
+        try:
+            contents = list_backup_contents(profile, self.default_save_location)
+        except Exception as e:
+            debug_print(f"Failed to list backup contents: {e}")
+            contents = []
+        GLib.idle_add(self.show_backup_contents, profile, contents)
+
+    def show_backup_contents(self, profile, contents):
+        if profile != self.profile_dropdown.get_active_id():
+            return  # The selection changed while loading
+        self.contents_store.clear()
+        for name, size in contents:
+            self.contents_store.append([False, name, format_size(size)])
+
+    def on_contents_item_toggled(self, widget, path):
+        self.contents_store[path][0] = not self.contents_store[path][0]
+
     def on_restore_button_clicked(self, widget):
-        profile = self.profile_dropdown.get_active_text()
+        profile = self.profile_dropdown.get_active_id()
         if not profile:
             self.show_message_dialog("Error", "No backup profile selected!")
             return
+        selected_paths = {row[1] for row in self.contents_store if row[0]}
         # Create a warning dialog 
         dialog = Gtk.MessageDialog(
             parent=self,
@@ -408,25 +711,52 @@ class RebornProfileManager(Gtk.Window):
             debug_print("Restore aborted by the user.")
             return
 
-        backup_file = self.default_save_location / profile
         self.restore_spinner.start()
-        Thread(target=self.perform_restore, args=(backup_file,), daemon=True).start()
+        Thread(target=self.perform_restore, args=(profile, selected_paths or None), daemon=True).start()
 
-    def perform_restore(self, backup_file):
+    def perform_restore(self, profile, names=None):
         try:
-            with tarfile.open(backup_file, "r:*") as tar:
-                members = tar.getmembers()
-                total_members = len(members)
+            progress = self.new_progress()
+            GLib.idle_add(self.start_progress_reporter, progress, OPERATION_RESTORE)
+            run_restore(profile, self.default_save_location, Path.home(), names, progress)
+            message = f"Restored {len(names)} selected paths!" if names else "Restore completed!"
+            if progress.instruments.report_file is not None:
+                message += f"\nRun report: {progress.instruments.report_file}"
+            GLib.idle_add(self.show_message_dialog, "Success", message)
+        except Exception as e:
+            GLib.idle_add(self.show_message_dialog, "Error", f"Restore failed: {str(e)}")
+        finally:
+            GLib.idle_add(self.finish_restore)
 
-                for i, member in enumerate(members):
-                    tar.extract(member, path=Path.home())
-                    GLib.idle_add(self.update_progress_bar, (i + 1) / total_members, OPERATION_RESTORE)
+    def on_verify_button_clicked(self, widget):
+        profile = self.profile_dropdown.get_active_id()
+        if not profile:
+            self.show_message_dialog("Error", "No backup profile selected!")
+            return
+        self.verify_button.set_sensitive(False)
+        self.restore_spinner.start()
+        Thread(target=self.perform_verify, args=(profile,), daemon=True).start()
 
-            GLib.idle_add(self.show_message_dialog, "Success", "Restore completed!")
+    def perform_verify(self, profile):
+        try:
+            progress = ProgressCounters()
+            GLib.idle_add(self.start_progress_reporter, progress, OPERATION_RESTORE)
+            problems = verify_backup(profile, self.default_save_location, progress)
+            if problems:
+                shown = "\n".join(problems[:20])
+                more = f"\n...and {len(problems) - 20} more" if len(problems) > 20 else ""
+                GLib.idle_add(self.show_message_dialog, "Error", f"Backup is damaged:\n{shown}{more}")
+            else:
+                GLib.idle_add(self.show_message_dialog, "Success", "Backup verified, all checksums match!")
         except Exception as e:
-            GLib.idle_add(self.show_message_dialog, "Error", f"Restore failed: {str(e)}")
+            GLib.idle_add(self.show_message_dialog, "Error", f"Verify failed: {str(e)}")
         finally:
-            GLib.idle_add(self.restore_spinner.stop)
+            GLib.idle_add(self.finish_restore)
+
+    def finish_restore(self):
+        self.stop_progress_reporter(OPERATION_RESTORE)
+        self.restore_spinner.stop()
+        self.verify_button.set_sensitive(True)
 
     def on_select_backup_folder(self, widget):
         dialog = Gtk.FileChooserDialog(
@@ -439,20 +769,151 @@ class RebornProfileManager(Gtk.Window):
         if dialog.run() == Gtk.ResponseType.OK:
             self.default_save_location = Path(dialog.get_filename())
             self.folder_label.set_text(f"Current Folder: {self.default_save_location}")
-            self.populate_restore_dropdown()
+            self.open_catalog()
+            self.update_resume_button()
 
         dialog.destroy()
 
+    def open_catalog(self):
+        """Switches the Restore tab to the catalog of the current backup folder and starts watching it."""
+        for monitor in self.folder_monitors:
+            monitor.cancel()
+        self.folder_monitors = []
+        if self.catalog is not None:
+            self.catalog.close()
+        self.catalog = BackupCatalog(self.default_save_location)
+
+        # Archives land in the folder itself, snapshots in the store's snapshot folder
+        for folder in (self.default_save_location, self.default_save_location / STORE_DIRNAME / "snapshots"):
+            if folder.is_dir():
+                monitor = Gio.File.new_for_path(str(folder)).monitor_directory(Gio.FileMonitorFlags.NONE, None)
+                monitor.connect("changed", self.on_backup_folder_changed)
+                self.folder_monitors.append(monitor)
+        self.populate_restore_dropdown()
+
     def populate_restore_dropdown(self):
+        """Shows the cached catalog straight away, then syncs it with the folder in the background."""
+        self.fill_restore_dropdown()
+        Thread(target=self.refresh_catalog, args=(self.catalog,), daemon=True).start()
+
+    def refresh_catalog(self, catalog):
+        try:
+            changed = catalog.refresh()
+        except Exception as e:
+            debug_print(f"Failed to refresh the backup catalog: {e}")
+            return
+        if changed:
+            GLib.idle_add(self.fill_restore_dropdown)
+
+    def fill_restore_dropdown(self):
+        active_id = self.profile_dropdown.get_active_id()
         self.profile_dropdown.remove_all()
-        if self.default_save_location.exists():
-            for file in self.default_save_location.glob("*.tar*"):
-                self.profile_dropdown.append_text(file.name)
+        for entry in self.catalog.query(self.catalog_sort, self.search_entry.get_text()):
+            self.profile_dropdown.append(entry["id"], catalog_label(entry))
+        if active_id:
+            self.profile_dropdown.set_active_id(active_id)
+
+    def on_backup_folder_changed(self, monitor, changed_file, other_file, event_type):
+        # A backup being written fires many events; refresh once it has settled
+        if self.catalog_refresh_source is not None:
+            GLib.source_remove(self.catalog_refresh_source)
+        self.catalog_refresh_source = GLib.timeout_add(CATALOG_REFRESH_DELAY_MS, self.on_catalog_refresh_due)
+
+    def on_catalog_refresh_due(self):
+        self.catalog_refresh_source = None
+        Thread(target=self.refresh_catalog, args=(self.catalog,), daemon=True).start()
+        return False
+
+    def on_catalog_filter_changed(self, widget):
+        self.fill_restore_dropdown()
+
+    def on_catalog_sort_changed(self, widget):
+        self.catalog_sort = widget.get_active_id()
+        self.fill_restore_dropdown()
 
     def on_toggle_compression(self, widget):
         self.compression_enabled = widget.get_active()
         debug_print(f"Compression enabled: {self.compression_enabled}")
 
+    def on_format_changed(self, widget):
+        self.backup_format = widget.get_active_id()
+        debug_print(f"Backup format: {self.backup_format}")
+
+    def on_snapshots_to_keep_changed(self, widget):
+        self.snapshots_to_keep = widget.get_value_as_int()
+
+    def on_prune_button_clicked(self, widget):
+        if self.backup_in_progress:
+            self.show_message_dialog("Error", "Cannot prune snapshots while a backup is running!")
+            return
+        # Garbage collection reads every snapshot and walks every chunk, so it runs off the main loop
+        self.prune_in_progress = True
+        widget.set_sensitive(False)
+        self.spinner.start()
+        Thread(target=self.perform_prune, args=(widget,), daemon=True).start()
+
+    def perform_prune(self, widget):
+        store = ChunkStore(self.default_save_location / STORE_DIRNAME)
+        try:
+            with store.locked(exclusive=True):  # Waits for a snapshot another process is writing
+                removed = store.prune(self.snapshots_to_keep)
+                chunks, freed = store.collect_garbage()
+            GLib.idle_add(
+                self.show_message_dialog,
+                "Success",
+                f"Removed {len(removed)} snapshots and {chunks} unused chunks ({freed / (1024 * 1024):.1f} MB freed)",
+            )
+        except Exception as e:
+            GLib.idle_add(self.show_message_dialog, "Error", f"Pruning failed: {str(e)}")
+        finally:
+            GLib.idle_add(self.finish_prune, widget)
+
+    def finish_prune(self, widget):
+        self.prune_in_progress = False
+        widget.set_sensitive(True)
+        self.spinner.stop()
+        self.populate_restore_dropdown()
+
+    def on_codec_changed(self, widget):
+        self.compression_codec = widget.get_active_id()
+        low, high, default = CODEC_LEVELS[self.compression_codec]
+        self.level_spin.set_range(low, high)
+        self.level_spin.set_value(default)
+        debug_print(f"Compression codec: {self.compression_codec}")
+
+    def on_level_changed(self, widget):
+        self.compression_level = widget.get_value_as_int()
+        debug_print(f"Compression level: {self.compression_level}")
+
+    def on_workers_changed(self, widget):
+        self.compression_workers = widget.get_value_as_int()
+        debug_print(f"Compression workers: {self.compression_workers}")
+
+    def on_toggle_incremental(self, widget):
+        self.incremental_enabled = widget.get_active()
+        debug_print(f"Incremental backups enabled: {self.incremental_enabled}")
+
+    def on_toggle_default_excludes(self, widget):
+        self.default_excludes_enabled = widget.get_active()
+        debug_print(f"Default exclusions enabled: {self.default_excludes_enabled}")
+
+    def on_toggle_skip_caches(self, widget):
+        self.skip_caches = widget.get_active()
+        debug_print(f"Skip CACHEDIR.TAG folders: {self.skip_caches}")
+
+    def on_exclude_patterns_changed(self, widget):
+        # Commas separate patterns because names like "Code Cache" contain spaces
+        self.exclude_patterns = [pattern.strip() for pattern in widget.get_text().split(",") if pattern.strip()]
+        debug_print(f"Extra exclude patterns: {self.exclude_patterns}")
+
+    def on_max_file_size_changed(self, widget):
+        self.max_file_size_mb = widget.get_value_as_int()
+        debug_print(f"Maximum file size: {self.max_file_size_mb} MB")
+
+    def on_toggle_reports(self, widget):
+        self.reports_enabled = widget.get_active()
+        debug_print(f"Run reports enabled: {self.reports_enabled}")
+
     def show_message_dialog(self, title, message):
         dialog = Gtk.Dialog(title=title, transient_for=self, flags=0)
         dialog.add_button(Gtk.STOCK_OK, Gtk.ResponseType.OK)
@@ -475,16 +936,6 @@ class RebornProfileManager(Gtk.Window):
         dialog.run()
         dialog.destroy()
 
-    def count_files(self, paths):
-        count = 0
-        for path in paths:
-            if os.path.isfile(path):
-                count += 1
-            elif os.path.isdir(path):
-                for _, _, files in os.walk(path):
-                    count += len(files)
-        return count
-
 if __name__ == "__main__":
     app = RebornProfileManager()
     app.connect("destroy", Gtk.main_quit)
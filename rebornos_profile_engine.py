@@ -0,0 +1,2947 @@
+"""Backup engine shared by the GTK window and the command line. Never imports gi."""
+import os
+import sys
+import grp
+import gzip
+import pwd
+import re
+import json
+import mmap
+import stat
+import errno
+import fcntl
+import zlib
+import queue
+import time
+import heapq
+import pstats
+import ctypes
+import shutil
+import cProfile
+import platform
+import sqlite3
+import hashlib
+import tarfile
+import tempfile
+from bisect import bisect_right
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from functools import lru_cache
+from pathlib import Path
+from datetime import datetime
+from threading import Thread, Event, Lock, Condition, get_ident, setprofile
+
+# Optional: multi-frame zstd archives when python-zstandard is installed
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Constants
+DEFAULT_SAVE_LOCATION = Path.home() / "Downloads"
+BACKUP_PREFIX = "profile_backup_"
+MANIFEST_SUFFIX = ".manifest.json"
+MANIFEST_VERSION = 1
+INDEX_SUFFIX = ".index.json"
+INDEX_VERSION = 1
+PARTIAL_SUFFIX = ".partial"
+JOURNAL_SUFFIX = ".journal"
+JOURNAL_VERSION = 1
+HASH_ALGORITHM = "blake2b"
+ARCHIVE_EXTENSIONS = (".tar", ".tar.gz", ".tar.zst")
+
+# Compression
+CODEC_GZIP = "gzip"
+CODEC_ZSTD = "zstd"
+CODEC_EXTENSIONS = {CODEC_GZIP: "tar.gz", CODEC_ZSTD: "tar.zst"}
+CODEC_LEVELS = {CODEC_GZIP: (1, 9, 6), CODEC_ZSTD: (1, 19, 3)}  # (min, max, default)
+COMPRESSION_BLOCK_SIZE = 1024 * 1024
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+DEFAULT_COMPRESSION_WORKERS = os.cpu_count() or 1
+
+# Uncompressed archives copy large file bodies inside the kernel
+ZERO_COPY_MIN_SIZE = 1024 * 1024
+ZERO_COPY_CHUNK_SIZE = 16 * 1024 * 1024  # Per copy_file_range call and per mmap window when hashing
+
+# Sparse files are stored as GNU sparse 1.0 members holding only their data regions
+SPARSE_MIN_SIZE = 64 * 1024
+SPARSE_NAME_PREFIX = "GNUSparseFile.0/"
+NLINK_PAX_KEY = "SCHILY.nlink"  # Link count star writes; marks the files a forward-only restore may need for a link
+
+# Restores share the blocks of duplicate files where the filesystem supports reflinks
+FICLONE = 0x40049409
+REFLINK_MIN_SIZE = 64 * 1024  # Smaller duplicates are cheaper to write than to clone
+
+# Checkpoints seal the archive written so far so an interrupted backup can resume
+CHECKPOINT_BYTES = 256 * 1024 * 1024
+CHECKPOINT_SECONDS = 30
+
+# Background service
+DAEMON_NICENESS = 19
+IOPRIO_CLASS_IDLE = 3
+IOPRIO_CLASS_SHIFT = 13
+IOPRIO_WHO_PROCESS = 1
+IOPRIO_SET_SYSCALLS = {"x86_64": 251, "i686": 289, "aarch64": 30, "riscv64": 30, "armv7l": 314}
+
+# Scanning
+SCAN_QUEUE_SIZE = 4096
+
+# Progress reporting
+PROGRESS_INTERVAL_MS = 250
+
+# Run reports: stage timers, counters and the slowest files, saved next to each archive
+REPORT_SUFFIX = ".report.json"
+REPORT_VERSION = 1
+REPORT_SLOWEST_FILES = 20
+PROFILE_SUFFIX = ".profile.prof"  # cProfile output, read with pstats or snakeviz
+TRACE_SUFFIX = ".trace.json"  # Chrome trace events, opened in Perfetto or chrome://tracing
+TRACE_MAX_EVENTS = 200000
+PROCESS_WIDE_PROFILER = sys.version_info >= (3, 12)  # cProfile runs on sys.monitoring there: one profiler sees every thread
+
+# Restoring
+RESTORE_WORKERS = min(16, (os.cpu_count() or 1) * 2)
+RESTORE_SMALL_FILE_SIZE = 4 * 1024 * 1024  # Larger files are streamed by the reader thread itself
+RESTORE_MAX_PENDING_BYTES = 64 * 1024 * 1024
+
+# Verifying
+VERIFY_WORKERS = os.cpu_count() or 1
+VERIFY_SEGMENT_SIZE = 8 * 1024 * 1024  # The archive file is checksummed in segments so they can be checked in parallel
+
+# Folder size cache and run reports
+CACHE_DIR = Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")) / "rebornos-profile-manager"
+FOLDER_SIZE_CACHE = CACHE_DIR / "folder_sizes.json"
+REPORTS_DIR = CACHE_DIR / "reports"  # Reports of runs that have no archive to sit next to
+
+# Deduplicating store
+FORMAT_ARCHIVE = "archive"
+FORMAT_STORE = "store"
+STORE_DIRNAME = "profile_store"
+STORE_LOCK_FILENAME = ".lock"  # flock()ed shared by snapshots, exclusively by pruning and garbage collection
+SNAPSHOT_PREFIX = "profile_snapshot_"
+SNAPSHOT_ID_PREFIX = "snapshot:"
+CHUNK_MIN_SIZE = 512 * 1024
+CHUNK_MAX_SIZE = 4 * 1024 * 1024
+CHUNK_SCAN_SIZE = 256 * 1024  # Bytes translated per boundary search step
+# Gear hash with one-bit entries: its low bits are the table bits of the last bytes, in order
+CHUNK_GEAR = bytes(b"01"[hashlib.blake2b(bytes([value]), digest_size=1).digest()[0] & 1] for value in range(256))
+CHUNK_CUT = b"11111010000011101011"  # 20 bits: a cut every 1 MiB past the minimum on average; changing it re-chunks everything
+
+# Backup catalog
+CATALOG_FILENAME = ".profile_catalog.sqlite"
+CATALOG_VERSION = 2
+CATALOG_SORTS = {
+    "newest": "created DESC",
+    "oldest": "created ASC",
+    "largest": "size DESC",
+    "name": "id ASC",
+}
+
+# Backup Items
+BACKUP_ITEMS = {
+    ".bashrc": None,
+    ".bash_profile": None,
+    ".ssh": None,
+    ".gnupg": None,
+    ".profile": None,
+    ".config": "recursive",
+    ".local": "recursive",
+    "Documents": None,
+    "Pictures": None,
+}
+
+EXCLUDED_ITEMS = [
+    "gtk-2.0",
+    "gtk-3.0",
+    "some_file"
+]
+
+# Skipped during the scan unless a backup turns them off; gitignore syntax, relative to the home folder
+DEFAULT_EXCLUDE_PATTERNS = [
+    ".cache/",
+    ".local/share/Trash/",
+    ".local/share/baloo/",
+    ".config/**/Cache/",
+    ".config/**/Code Cache/",
+    ".config/**/GPUCache/",
+    ".config/**/CacheStorage/",
+    "node_modules/",
+    "__pycache__/",
+]
+CACHEDIR_TAG = "CACHEDIR.TAG"
+CACHEDIR_SIGNATURE = b"Signature: 8a477f597d28d172789f06886806bc55"
+
+# Some simple debugging
+DEBUG_MODE = False
+
+def debug_print(message):
+    if DEBUG_MODE:
+        print(message, file=sys.stderr)  # Keeps stdout clean for the command line's JSON output
+
+def format_size(num_bytes):
+    for unit in ("B", "KB", "MB", "GB"):
+        if num_bytes < 1024:
+            return f"{num_bytes:.1f} {unit}" if unit != "B" else f"{num_bytes} B"
+        num_bytes /= 1024
+    return f"{num_bytes:.1f} TB"
+
+def available_codecs():
+    return [CODEC_GZIP, CODEC_ZSTD] if zstandard is not None else [CODEC_GZIP]
+
+def compress_block(data, codec, level):
+    """Compresses one block into a self-contained gzip member or zstd frame."""
+    if codec == CODEC_ZSTD:
+        return zstandard.ZstdCompressor(level=level).compress(data)
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)  # gzip header and trailer
+    return compressor.compress(data) + compressor.flush()
+
+class ParallelCompressor:
+    """Write-only file object that compresses fixed-size blocks on a thread pool.
+
+    Blocks are written in order as concatenated gzip members (like pigz) or zstd
+    frames, both of which standard tools read back as a single stream. zlib and
+    zstandard release the GIL while compressing, so threads scale across cores.
+    """
+
+    def __init__(self, fileobj, codec=CODEC_GZIP, level=None, workers=DEFAULT_COMPRESSION_WORKERS, instruments=None):
+        if codec not in available_codecs():
+            raise ValueError(f"Compression codec not available: {codec}")
+        self.fileobj = fileobj
+        self.instruments = instruments or NO_INSTRUMENTATION
+        self.codec = codec
+        self.level = level if level is not None else CODEC_LEVELS[codec][2]
+        self.workers = max(1, workers)
+        self.executor = ThreadPoolExecutor(max_workers=self.workers)
+        self.pending = deque()
+        self.buffer = bytearray()
+        self.position = 0
+        self.block_start = 0
+        self.compressed_position = 0
+        self.blocks = []  # [compressed offset, uncompressed offset] of every block, for seeking
+
+    def write(self, data):
+        self.buffer += data
+        self.position += len(data)
+        while len(self.buffer) >= COMPRESSION_BLOCK_SIZE:
+            self.submit_block(bytes(self.buffer[:COMPRESSION_BLOCK_SIZE]))
+            del self.buffer[:COMPRESSION_BLOCK_SIZE]
+        return len(data)
+
+    def tell(self):
+        return self.position  # Uncompressed position, which is what tarfile tracks
+
+    def compress(self, block):
+        started = time.perf_counter()
+        data = compress_block(block, self.codec, self.level)
+        self.instruments.add_time("compress", started)
+        return data
+
+    def submit_block(self, block):
+        self.pending.append((self.block_start, self.executor.submit(self.compress, block)))
+        self.block_start += len(block)
+        # Bound memory use to a couple of blocks per worker
+        while len(self.pending) > self.workers * 2:
+            self.write_next_block()
+
+    def write_next_block(self):
+        block_start, future = self.pending.popleft()
+        started = time.perf_counter()
+        data = future.result()
+        self.instruments.add_time("compress wait", started)
+        self.blocks.append([self.compressed_position, block_start])
+        started = time.perf_counter()
+        self.fileobj.write(data)
+        self.instruments.add_time("write", started)
+        self.compressed_position += len(data)
+
+    def flush(self):
+        """Compresses and writes everything buffered so far, ending on a complete gzip member or zstd frame."""
+        if self.buffer:
+            self.submit_block(bytes(self.buffer))
+            self.buffer.clear()
+        while self.pending:
+            self.write_next_block()
+
+    def resume_at(self, compressed_position, position, blocks):
+        """Continues an archive whose first compressed_position bytes are already on disk."""
+        self.compressed_position = compressed_position
+        self.position = self.block_start = position
+        self.blocks = blocks
+
+    def close(self):
+        self.flush()
+        self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+# Exclusion rules applied while scanning
+def strip_pattern(line):
+    """Drops surrounding whitespace from a pattern line, except a trailing space escaped with a backslash."""
+    line = line.rstrip("\r\n").lstrip()
+    stripped = line.rstrip()
+    backslashes = len(stripped) - len(stripped.rstrip("\\"))
+    if stripped != line and backslashes % 2:
+        stripped += line[len(stripped)]  # gitignore keeps "foo\ " as "foo "
+    return stripped
+
+def gitignore_regex(pattern):
+    """Translates one gitignore pattern (without '!') into a regex over 'relative/path' or 'relative/dir/'.
+
+    A backslash makes the next character literal, as in '\\#notes', '\\!important' or 'trailing\\ '.
+    """
+    dir_only = pattern.endswith("/")
+    pattern = pattern.rstrip("/")
+    anchored = "/" in pattern  # gitignore anchors any pattern with an inner or leading slash
+    pattern = pattern.lstrip("/")
+    parts, i = [], 0
+    while i < len(pattern):
+        if pattern[i] == "\\" and i + 1 < len(pattern):
+            parts.append(re.escape(pattern[i + 1]))
+            i += 2
+        elif pattern.startswith("**/", i):
+            parts.append("(?:.*/)?")
+            i += 3
+        elif pattern.startswith("**", i):
+            parts.append(".+" if i + 2 == len(pattern) else ".*")  # A trailing /** matches inside, not the folder itself
+            i += 2
+        elif pattern[i] == "*":
+            parts.append("[^/]*")
+            i += 1
+        elif pattern[i] == "?":
+            parts.append("[^/]")
+            i += 1
+        elif pattern[i] == "[" and "]" in pattern[i + 2:]:
+            end = pattern.index("]", i + 2)
+            body = pattern[i + 1:end]
+            parts.append("[" + ("^" + body[1:] if body.startswith("!") else body).replace("\\", "\\\\") + "]")
+            i = end + 1
+        else:
+            parts.append(re.escape(pattern[i]))
+            i += 1
+    return ("" if anchored else "(?:.*/)?") + "".join(parts) + ("/" if dir_only else "/?")
+
+class ExclusionRules:
+    """Compiled gitignore-style patterns, a file size limit and CACHEDIR.TAG detection.
+
+    Consecutive patterns of the same sign share one regex, so a path costs a
+    single match in the common case of no '!' patterns. Paths are relative to
+    the home folder; directories are matched with a trailing slash.
+    """
+
+    def __init__(self, patterns=DEFAULT_EXCLUDE_PATTERNS, max_file_size=None, skip_caches=True):
+        self.patterns = [pattern for pattern in map(strip_pattern, patterns) if pattern and not pattern.startswith("#")]
+        self.max_file_size = max_file_size or None
+        self.skip_caches = skip_caches
+        self.groups = []  # (excluding, compiled regex), evaluated last to first like gitignore
+        for pattern in self.patterns:
+            excluding = not pattern.startswith("!")
+            regex = gitignore_regex(pattern if excluding else pattern[1:])
+            if self.groups and self.groups[-1][0] == excluding:
+                self.groups[-1][1].append(regex)
+            else:
+                self.groups.append((excluding, [regex]))
+        self.groups = [(excluding, re.compile("(?:" + "|".join(regexes) + ")\\Z")) for excluding, regexes in self.groups]
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["patterns"], data.get("max_file_size"), data.get("skip_caches", True))
+
+    def to_dict(self):
+        return {"patterns": self.patterns, "max_file_size": self.max_file_size, "skip_caches": self.skip_caches}
+
+    def excludes(self, relpath, stat_result):
+        is_dir = stat.S_ISDIR(stat_result.st_mode)
+        if not is_dir and self.max_file_size is not None and stat_result.st_size > self.max_file_size:
+            return True
+        path = relpath + "/" if is_dir else relpath
+        for excluding, regex in reversed(self.groups):
+            if regex.match(path):
+                return excluding
+        return False
+
+    def is_cache_directory(self, path, names):
+        """Whether a directory carries a valid CACHEDIR.TAG (https://bford.info/cachedir/)."""
+        if not self.skip_caches or CACHEDIR_TAG not in names:
+            return False
+        try:
+            with open(os.path.join(path, CACHEDIR_TAG), "rb") as f:
+                return f.read(len(CACHEDIR_SIGNATURE)) == CACHEDIR_SIGNATURE
+        except OSError:
+            return False
+
+def read_exclude_file(path):
+    """Reads patterns from a .gitignore-style file, one per line."""
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read().splitlines()
+
+# Single-pass scanner feeding the archiver
+ScanEntry = namedtuple("ScanEntry", ["path", "arcname", "stat"])
+
+def entry_bytes(stat_result):
+    """Bytes a scanned entry contributes to progress; directories count as zero."""
+    return 0 if stat.S_ISDIR(stat_result.st_mode) else stat_result.st_size
+
+class ScanEstimate:
+    """Running estimate of the total backup size, refined while the scanner walks.
+
+    Only the scanner thread writes these counters; readers tolerate slightly stale values.
+    """
+
+    def __init__(self):
+        self.files_seen = 0
+        self.bytes_seen = 0
+        self.dirs_found = 0
+        self.dirs_done = 0
+        self.finished = False
+
+    def add(self, stat_result):
+        self.files_seen += 1
+        self.bytes_seen += entry_bytes(stat_result)
+
+    def total_bytes(self):
+        if self.finished or self.dirs_done == 0:
+            return self.bytes_seen
+        # Assume the directories still queued hold as much as the ones already walked
+        return self.bytes_seen * self.dirs_found / self.dirs_done
+
+    def fraction(self, processed_bytes):
+        total = self.total_bytes()
+        if total <= 0:
+            return 0.0
+        fraction = processed_bytes / total
+        return min(fraction, 1.0 if self.finished else 0.99)
+
+class Instrumentation:
+    """Stage timers, counters and the slowest files of one backup or restore, saved as a JSON run report.
+
+    Stages timed on worker threads add up across threads, so compare them
+    with each other rather than with the wall time. Every thread can also be
+    profiled with cProfile, and stage timings recorded as a Chrome trace.
+    """
+
+    enabled = True
+
+    def __init__(self, profile=False, trace=False):
+        self.lock = Lock()
+        self.created = timestamp_now()
+        self.started = time.perf_counter()
+        self.stages = {}  # name -> [seconds, calls]
+        self.counters = {}
+        self.slowest = []  # Min-heap of (seconds, path, bytes)
+        self.trace_events = [] if trace else None
+        self.profilers = []
+        self.profiling = False
+        self.report_file = None
+        if profile:
+            self.profiling = True
+            if not PROCESS_WIDE_PROFILER:
+                setprofile(self.profile_thread)  # Threads started from now on profile themselves
+            self.profile_thread()
+
+    def profile_thread(self, *args):
+        sys.setprofile(None)
+        profiler = cProfile.Profile()
+        with self.lock:
+            self.profilers.append(profiler)
+        profiler.enable()
+
+    def stop_profile(self):
+        """Stops profiling and returns every thread's profile merged into one pstats.Stats, or None."""
+        if not self.profiling:
+            return None
+        if not PROCESS_WIDE_PROFILER:
+            setprofile(None)
+        self.profiling = False
+        stats = None
+        for profiler in self.profilers:
+            profiler.disable()
+            try:
+                if stats is None:
+                    stats = pstats.Stats(profiler)
+                else:
+                    stats.add(profiler)
+            except TypeError:
+                pass  # A thread that never ran any Python code
+        return stats
+
+    def add_time(self, stage, started, ended=None):
+        ended = ended or time.perf_counter()
+        with self.lock:
+            totals = self.stages.setdefault(stage, [0.0, 0])
+            totals[0] += ended - started
+            totals[1] += 1
+            if self.trace_events is not None and len(self.trace_events) < TRACE_MAX_EVENTS:
+                self.trace_events.append({
+                    "name": stage,
+                    "ph": "X",
+                    "ts": round((started - self.started) * 1e6),
+                    "dur": round((ended - started) * 1e6),
+                    "pid": os.getpid(),
+                    "tid": get_ident(),
+                })
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, started)
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def file_done(self, stage, path, started, size):
+        """Times one file's stage and keeps it if it is among the slowest so far."""
+        ended = time.perf_counter()
+        self.add_time(stage, started, ended)
+        item = (ended - started, str(path), size)
+        with self.lock:
+            if len(self.slowest) < REPORT_SLOWEST_FILES:
+                heapq.heappush(self.slowest, item)
+            elif item > self.slowest[0]:
+                heapq.heapreplace(self.slowest, item)
+
+    def report(self, operation, **fields):
+        with self.lock:
+            stages = sorted(self.stages.items(), key=lambda stage: stage[1][0], reverse=True)
+            return {
+                "version": REPORT_VERSION,
+                "operation": operation,
+                "created": self.created,
+                "seconds": round(time.perf_counter() - self.started, 3),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpu_count": os.cpu_count(),
+                **fields,
+                "stages": {name: {"seconds": round(seconds, 4), "calls": calls} for name, (seconds, calls) in stages},
+                "counters": dict(sorted(self.counters.items())),
+                "slowest_files": [{"path": path, "seconds": round(seconds, 4), "bytes": size} for seconds, path, size in sorted(self.slowest, reverse=True)],
+            }
+
+    def save(self, path, operation, **fields):
+        """Writes the report next to path, with the profile and trace when enabled, and returns the report."""
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        stats = self.stop_profile()
+        if stats is not None:
+            stats.dump_stats(sidecar_path(path, PROFILE_SUFFIX))
+            fields["profile"] = str(sidecar_path(path, PROFILE_SUFFIX))
+        if self.trace_events is not None:
+            write_json_atomic(sidecar_path(path, TRACE_SUFFIX), {"traceEvents": self.trace_events, "displayTimeUnit": "ms"})
+            fields["trace"] = str(sidecar_path(path, TRACE_SUFFIX))
+        report = self.report(operation, **fields)
+        save_sidecar(path, REPORT_SUFFIX, report)
+        self.report_file = sidecar_path(path, REPORT_SUFFIX)
+        return report
+
+class NullInstrumentation:
+    """Stands in while instrumentation is off; every hook is a no-op."""
+
+    enabled = False
+    report_file = None
+
+    def add_time(self, stage, started, ended=None):
+        pass
+
+    def stage(self, name):
+        return NULL_STAGE
+
+    def count(self, name, amount=1):
+        pass
+
+    def file_done(self, stage, path, started, size):
+        pass
+
+NULL_STAGE = nullcontext()
+NO_INSTRUMENTATION = NullInstrumentation()
+
+def report_path(operation):
+    """Where reports go for runs without an archive of their own, such as restores and streams."""
+    return REPORTS_DIR / f"{operation}_{timestamp_now()}"
+
+class ProgressCounters:
+    """Progress counters that worker threads bump and a UI timer samples at a fixed rate."""
+
+    def __init__(self, total_files=0, total_bytes=0, estimate=None, instruments=None):
+        self.instruments = instruments or NO_INSTRUMENTATION  # Shared by every stage this progress is passed to
+        self.lock = Lock()
+        self.files = 0
+        self.bytes = 0
+        self.total_files = total_files
+        self.total_bytes = total_bytes
+        self.estimate = estimate  # ScanEstimate for backups, whose total grows while scanning
+        self.started = time.monotonic()
+
+    def add(self, files=0, num_bytes=0):
+        with self.lock:
+            self.files += files
+            self.bytes += num_bytes
+
+    def add_totals(self, files=0, num_bytes=0):
+        with self.lock:
+            self.total_files += files
+            self.total_bytes += num_bytes
+
+    def sample(self):
+        """Returns (files, bytes, fraction, elapsed seconds) as one consistent reading."""
+        with self.lock:
+            files, num_bytes = self.files, self.bytes
+            total_files, total_bytes = self.total_files, self.total_bytes
+        if self.estimate is not None:
+            fraction = self.estimate.fraction(num_bytes)
+        elif total_bytes:
+            fraction = num_bytes / total_bytes
+        elif total_files:
+            fraction = files / total_files
+        else:
+            fraction = 0.0
+        return files, num_bytes, min(fraction, 1.0), time.monotonic() - self.started
+
+def scan_items(items, home, abort_event, estimate, rules=None):
+    """Yields a ScanEntry for every file and directory below items, reusing the stat results os.scandir caches.
+
+    Directories are yielded before their contents so a restore can create them first.
+    Paths the rules exclude are skipped, and excluded or cache-tagged
+    directories are never entered. The items themselves are always kept.
+    """
+    for item in items:
+        try:
+            stat_result = os.lstat(item)
+        except FileNotFoundError:
+            debug_print(f"Skipping non-existent item: {item}")
+            continue
+
+        estimate.add(stat_result)
+        yield ScanEntry(str(item), os.path.relpath(item, home), stat_result)
+        if not stat.S_ISDIR(stat_result.st_mode):
+            continue
+
+        stack = [str(item)]
+        estimate.dirs_found += 1
+        while stack:
+            if abort_event.is_set():
+                return
+            current = stack.pop()
+            try:
+                with os.scandir(current) as it:
+                    entries = list(it)
+            except OSError as e:
+                debug_print(f"Skipping unreadable directory {current}: {e}")
+                entries = []
+            if rules is not None and rules.is_cache_directory(current, [entry.name for entry in entries]):
+                debug_print(f"Skipping the contents of cache directory {current}")
+                entries = []
+            for entry in entries:
+                try:
+                    stat_result = entry.stat(follow_symlinks=False)
+                except OSError as e:  # Vanished or unreadable since the listing; its siblings are still fine
+                    debug_print(f"Skipping {entry.path}: {e}")
+                    continue
+                arcname = os.path.relpath(entry.path, home)
+                if rules is not None and rules.excludes(arcname, stat_result):
+                    continue
+                if stat.S_ISDIR(stat_result.st_mode):
+                    stack.append(entry.path)
+                    estimate.dirs_found += 1
+                estimate.add(stat_result)
+                yield ScanEntry(entry.path, arcname, stat_result)
+            estimate.dirs_done += 1
+
+def stream_scan(items, home, abort_event, estimate, rules=None, instruments=NO_INSTRUMENTATION):
+    """Runs scan_items on its own thread and streams entries through a bounded queue."""
+    entries = queue.Queue(maxsize=SCAN_QUEUE_SIZE)
+    stopped = Event()
+    done = object()
+
+    def offer(item):
+        while not stopped.is_set():
+            try:
+                entries.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def producer():
+        started = time.perf_counter()
+        outcome = done
+        try:
+            for entry in scan_items(items, home, abort_event, estimate, rules):
+                if not offer(entry):
+                    return
+            estimate.finished = True
+            instruments.add_time("scan", started)
+        except BaseException as e:
+            outcome = e
+        finally:
+            offer(outcome)  # Always, so the consumer never waits on a dead thread
+
+    Thread(target=producer, daemon=True).start()
+    try:
+        while True:
+            try:
+                entry = entries.get_nowait()
+            except queue.Empty:
+                # Only timed when the consumer actually has to wait for the scan
+                started = time.perf_counter()
+                entry = entries.get()
+                instruments.add_time("scan wait", started)
+            if entry is done:
+                return
+            if isinstance(entry, BaseException):
+                raise entry
+            yield entry
+    finally:
+        stopped.set()  # Lets the producer exit if the consumer stops early
+
+@lru_cache(maxsize=None)
+def user_name(uid):
+    try:
+        return pwd.getpwuid(uid).pw_name
+    except KeyError:
+        return ""
+
+@lru_cache(maxsize=None)
+def group_name(gid):
+    try:
+        return grp.getgrgid(gid).gr_name
+    except KeyError:
+        return ""
+
+def tarinfo_from_stat(path, arcname, stat_result):
+    """Builds a TarInfo from an existing stat result instead of letting tarfile stat the path again."""
+    tarinfo = tarfile.TarInfo(arcname)
+    tarinfo.mode = stat.S_IMODE(stat_result.st_mode)
+    tarinfo.uid = stat_result.st_uid
+    tarinfo.gid = stat_result.st_gid
+    tarinfo.uname = user_name(stat_result.st_uid)
+    tarinfo.gname = group_name(stat_result.st_gid)
+    tarinfo.mtime = stat_result.st_mtime
+    if stat.S_ISREG(stat_result.st_mode):
+        tarinfo.type = tarfile.REGTYPE
+        tarinfo.size = stat_result.st_size
+    elif stat.S_ISLNK(stat_result.st_mode):
+        tarinfo.type = tarfile.SYMTYPE
+        tarinfo.linkname = os.readlink(path)
+    elif stat.S_ISDIR(stat_result.st_mode):
+        tarinfo.type = tarfile.DIRTYPE
+    else:
+        return None  # Sockets, fifos and device nodes are not backed up
+    return tarinfo
+
+@contextmanager
+def open_archive(path):
+    """Opens any backup archive for reading; zstd archives are read as a forward-only stream."""
+    path = Path(path)
+    if path.name.endswith(".tar.zst"):
+        with open(path, "rb") as raw, open_stream_archive(raw) as tar:
+            yield tar
+    else:
+        with tarfile.open(path, "r:*") as tar:
+            yield tar
+
+class PrefixedReader:
+    """Puts bytes already read from a non-seekable stream back in front of it."""
+
+    def __init__(self, prefix, stream):
+        self.prefix = prefix
+        self.stream = stream
+
+    def read(self, size=-1):
+        if not self.prefix:
+            return self.stream.read(size)
+        if size < 0:
+            data, self.prefix = self.prefix + self.stream.read(), b""
+            return data
+        data, self.prefix = self.prefix[:size], self.prefix[size:]
+        return data
+
+@contextmanager
+def open_stream_archive(stream):
+    """Opens a backup read forward-only from any binary stream, detecting the codec from its magic bytes.
+
+    tarfile's own "r|gz" stops after the first gzip member, so multi-member
+    archives written by ParallelCompressor go through GzipFile instead.
+    """
+    head = stream.read(4)
+    reader = PrefixedReader(head, stream)
+    if head.startswith(GZIP_MAGIC):
+        with gzip.GzipFile(fileobj=reader, mode="rb") as decompressed, tarfile.open(fileobj=decompressed, mode="r|") as tar:
+            yield tar
+    elif head.startswith(ZSTD_MAGIC):
+        if zstandard is None:
+            raise RuntimeError("Restoring .tar.zst backups requires the python-zstandard package")
+        with zstandard.ZstdDecompressor().stream_reader(reader, read_across_frames=True) as decompressed:
+            with tarfile.open(fileobj=decompressed, mode="r|") as tar:
+                yield tar
+    else:
+        with tarfile.open(fileobj=reader, mode="r|") as tar:
+            yield tar
+
+# Sidecar files written next to each archive
+def write_json_atomic(path, data):
+    tmp_path = Path(path).with_name(Path(path).name + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)  # Never leave a half-written sidecar behind
+
+def sidecar_path(backup_file, suffix):
+    backup_file = Path(backup_file)
+    return backup_file.with_name(backup_file.name + suffix)
+
+def load_sidecar(backup_file, suffix):
+    path = sidecar_path(backup_file, suffix)
+    if not path.exists():
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def save_sidecar(backup_file, suffix, data):
+    write_json_atomic(sidecar_path(backup_file, suffix), data)
+
+# Manifest helpers for incremental backups
+def load_manifest(backup_file):
+    return load_sidecar(backup_file, MANIFEST_SUFFIX)
+
+def save_manifest(backup_file, manifest):
+    save_sidecar(backup_file, MANIFEST_SUFFIX, manifest)
+
+def find_latest_manifest(location):
+    """Returns (backup_file, manifest) of the newest backup that still has its archive, or (None, None)."""
+    for path in sorted(Path(location).glob(f"{BACKUP_PREFIX}*{MANIFEST_SUFFIX}"), reverse=True):
+        backup_file = path.with_name(path.name[: -len(MANIFEST_SUFFIX)])
+        if backup_file.exists():
+            return backup_file, load_manifest(backup_file)
+    return None, None
+
+def incremental_chain_length(location):
+    """How many incrementals the newest archive in location is from its full backup; 0 when it is full or there is none."""
+    _, manifest = find_latest_manifest(location)
+    length = 0
+    while manifest is not None and manifest.get("parent"):
+        length += 1
+        manifest = load_manifest(Path(location) / manifest["parent"])
+    return length
+
+def manifest_entry_unchanged(previous, stat_result):
+    return (
+        previous is not None
+        and previous["size"] == stat_result.st_size
+        and previous["mtime"] == stat_result.st_mtime_ns
+        and previous["inode"] == stat_result.st_ino
+    )
+
+def manifest_hashes(backup_file):
+    """Maps each file in a backup's manifest to its content hash, so a restore can clone duplicates."""
+    manifest = load_manifest(backup_file)
+    if manifest is None:
+        return {}
+    return {arcname: entry["hash"] for arcname, entry in manifest["files"].items() if entry.get("hash")}
+
+def resolve_restore_chain(backup_file):
+    """Maps each archive needed to rebuild backup_file to the member names to extract from it."""
+    manifest = load_manifest(backup_file)
+    if manifest is None:
+        return None
+    plan = {}
+    for arcname, entry in manifest["files"].items():
+        plan.setdefault(entry["archive"], set()).add(arcname)
+    return plan
+
+# Parallel restore pipeline
+class ParallelExtractor:
+    """Restores members handed over by a single reading thread using a pool of writer threads.
+
+    The reader decompresses and reads small files into memory, writers create
+    them concurrently, and directory permissions and mtimes are applied in one
+    batch at the end so writing children does not disturb them. Large files are
+    preallocated and streamed by the reader to keep memory use bounded.
+    """
+
+    def __init__(self, destination, progress=None, workers=RESTORE_WORKERS, hashes=None):
+        self.destination = Path(destination)
+        self.progress = progress
+        self.executor = ThreadPoolExecutor(max_workers=max(1, workers))
+        self.futures = []
+        self.instruments = progress.instruments if progress else NO_INSTRUMENTATION
+        self.hashes = hashes or {}  # Member name -> content hash, from the manifest
+        self.restored = {}  # Content hash -> (path, pending write) of its first restored copy
+        self.links = []
+        self.directories = []
+        self.created_dirs = set()
+        self.pending_bytes = 0
+        self.budget = Condition()
+
+    def target_path(self, name):
+        parts = Path(name).parts
+        if not parts or Path(name).is_absolute() or ".." in parts:
+            raise ValueError(f"Refusing to restore path outside the destination: {name}")
+        return self.destination.joinpath(*parts)
+
+    def make_parent(self, target):
+        parent = target.parent
+        if parent not in self.created_dirs:
+            parent.mkdir(parents=True, exist_ok=True)
+            self.created_dirs.add(parent)
+
+    def add_directory(self, name, mode, mtime):
+        target = self.target_path(name)
+        target.mkdir(parents=True, exist_ok=True)
+        self.created_dirs.add(target)
+        self.directories.append((target, mode, mtime))
+        self.done(0)
+
+    def add_symlink(self, name, linkname):
+        target = self.target_path(name)
+        self.make_parent(target)
+        if os.path.lexists(target):
+            os.unlink(target)
+        os.symlink(linkname, target)
+        self.done(0)
+
+    def add_hardlink(self, name, linkname):
+        """Queues a hard link; it is made once every file has been written, so its target exists."""
+        target = self.target_path(name)
+        self.make_parent(target)
+        self.links.append((self.target_path(linkname), target))
+        self.instruments.count("hard links")
+        self.done(0)
+
+    def add_file(self, name, mode, mtime, size, source):
+        """Restores one regular file whose size bytes are read from source.read().
+
+        A file with the same content as one restored earlier is cloned from
+        it instead, and its data is never read.
+        """
+        target = self.target_path(name)
+        self.make_parent(target)
+        content = self.hashes.get(name) if size >= REFLINK_MIN_SIZE else None
+        if content in self.restored:
+            self.instruments.count("cloned files")
+            self.futures.append(self.executor.submit(self.clone_file, self.restored[content], target, mode, mtime, size))
+            return
+        if size > RESTORE_SMALL_FILE_SIZE:
+            self.write_file(target, mode, mtime, size, source)
+            if content:
+                self.restored[content] = (target, None)
+            return
+
+        started = time.perf_counter()
+        data = read_exactly(source, size)
+        self.instruments.add_time("read", started)
+        started = time.perf_counter()
+        with self.budget:
+            # Bound the data read ahead of the writers
+            while self.pending_bytes and self.pending_bytes + size > RESTORE_MAX_PENDING_BYTES:
+                self.budget.wait()
+            self.pending_bytes += size
+        self.instruments.add_time("write wait", started)
+        future = self.executor.submit(self.write_buffered, target, mode, mtime, data)
+        self.futures.append(future)
+        if content:
+            self.restored[content] = (target, future)
+
+    def add_sparse_file(self, name, mode, mtime, size, extents, source):
+        """Restores a sparse file: only its (offset, length) data regions are read from source, the rest stays a hole."""
+        started = time.perf_counter()
+        target = self.target_path(name)
+        self.make_parent(target)
+        if os.path.islink(target):
+            os.unlink(target)
+        fd = os.open(target, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        try:
+            for offset, length in extents:
+                os.lseek(fd, offset, os.SEEK_SET)
+                while length > 0:
+                    block = source.read(min(length, COMPRESSION_BLOCK_SIZE))
+                    if not block:
+                        raise EOFError(f"Unexpected end of archive data for {target}")
+                    write_all(fd, block)
+                    length -= len(block)
+            os.ftruncate(fd, size)
+            os.fchmod(fd, mode)
+        finally:
+            os.close(fd)
+        os.utime(target, (mtime, mtime))
+        self.instruments.count("sparse files")
+        self.instruments.file_done("write", target, started, size)
+        self.done(size)
+
+    def add_member(self, tar, member):
+        if member.isdir():
+            self.add_directory(member.name, member.mode, member.mtime)
+        elif member.issym():
+            self.add_symlink(member.name, member.linkname)
+        elif member.islnk():
+            self.add_hardlink(member.name, member.linkname)
+        elif member.isreg() and member.sparse is not None:
+            # Read the stored regions directly rather than through extractfile, which fills in the holes
+            tar.fileobj.seek(member.offset_data)
+            size = int(member.pax_headers.get("GNU.sparse.realsize", member.size))
+            self.add_sparse_file(member.name, member.mode, member.mtime, size, member.sparse, tar.fileobj)
+        elif member.isreg():
+            self.add_file(member.name, member.mode, member.mtime, member.size, tar.extractfile(member))
+        else:
+            tar.extract(member, path=self.destination)  # Hard links, fifos and devices from foreign archives
+            self.done(member.size)
+
+    def write_buffered(self, target, mode, mtime, data):
+        try:
+            self.write_file(target, mode, mtime, len(data), None, data)
+        finally:
+            with self.budget:
+                self.pending_bytes -= len(data)
+                self.budget.notify_all()
+
+    def clone_file(self, first, target, mode, mtime, size):
+        source, pending = first
+        if pending is not None:
+            pending.result()  # Submitted earlier, so it is already running or done
+        started = time.perf_counter()
+        if os.path.islink(target):
+            os.unlink(target)
+        with open(source, "rb") as f:
+            fd = os.open(target, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            try:
+                clone_file_data(f.fileno(), fd, size)
+                os.fchmod(fd, mode)
+            finally:
+                os.close(fd)
+        os.utime(target, (mtime, mtime))
+        self.instruments.file_done("clone", target, started, size)
+        self.done(size)
+
+    def write_file(self, target, mode, mtime, size, source, data=None):
+        started = time.perf_counter()
+        if os.path.islink(target):
+            os.unlink(target)  # Never write through a symlink left at the target path
+        fd = os.open(target, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        try:
+            if data is not None:
+                write_all(fd, data)
+            else:
+                try:
+                    os.posix_fallocate(fd, 0, size)
+                except OSError:
+                    pass  # Filesystems without fallocate support still work, just less contiguously
+                remaining = size
+                while remaining > 0:
+                    block = source.read(min(remaining, COMPRESSION_BLOCK_SIZE))
+                    if not block:
+                        raise EOFError(f"Unexpected end of archive data for {target}")
+                    write_all(fd, block)
+                    remaining -= len(block)
+            os.fchmod(fd, mode)
+        finally:
+            os.close(fd)
+        os.utime(target, (mtime, mtime))
+        self.instruments.file_done("write", target, started, size)
+        self.done(size)
+
+    def done(self, size):
+        if self.progress:
+            self.progress.add(1, size)
+
+    def finish(self):
+        """Waits for every writer, makes the hard links, then applies directory metadata deepest first."""
+        started = time.perf_counter()
+        try:
+            for future in self.futures:
+                future.result()
+        finally:
+            self.executor.shutdown()
+        self.instruments.add_time("write wait", started)
+        started = time.perf_counter()
+        missing = []
+        for source, target in self.links:
+            if os.path.lexists(target):
+                os.unlink(target)
+            try:
+                os.link(source, target)
+            except FileNotFoundError:
+                missing.append(str(target))
+        for target, mode, mtime in sorted(self.directories, key=lambda d: len(d[0].parts), reverse=True):
+            os.chmod(target, mode)
+            os.utime(target, (mtime, mtime))
+        self.instruments.add_time("finish", started)
+        if missing:
+            raise FileNotFoundError(f"Hard links whose target was not restored: {', '.join(missing)}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.finish()
+        else:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+
+def write_all(fd, data):
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view):]
+
+def read_exactly(source, size):
+    data = source.read(size)
+    if len(data) != size:
+        raise EOFError("Unexpected end of archive data")
+    return data
+
+# Random-access index for selective restore
+def index_record(tarinfo, data_offset):
+    record = {"name": tarinfo.name, "offset": data_offset, "size": tarinfo.size, "mtime": tarinfo.mtime, "mode": tarinfo.mode}
+    if tarinfo.issym():
+        record["type"] = "symlink"
+        record["linkname"] = tarinfo.linkname
+    elif tarinfo.islnk():
+        record["type"] = "hardlink"
+        record["linkname"] = tarinfo.linkname
+    elif tarinfo.isdir():
+        record["type"] = "dir"
+    else:
+        record["type"] = "file"
+    return record
+
+def load_index(backup_file):
+    return load_sidecar(backup_file, INDEX_SUFFIX)
+
+def save_index(backup_file, index):
+    save_sidecar(backup_file, INDEX_SUFFIX, index)
+
+class IndexedArchive:
+    """Reads member data straight from an archive by seeking to the compressed block that holds it."""
+
+    def __init__(self, backup_file, index):
+        self.index = index
+        self.codec = index["codec"]
+        self.blocks = index["blocks"]
+        self.block_starts = [block[1] for block in self.blocks]
+        self.raw = open(backup_file, "rb")
+        self.stream = None
+        self.position = 0
+
+    def close(self):
+        self.raw.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def seek(self, offset):
+        # Keep decompressing forward when the target is close, rather than restarting at a block
+        if self.stream is not None and self.position <= offset < self.position + COMPRESSION_BLOCK_SIZE:
+            self.skip(offset - self.position)
+            return
+        if self.codec is None:
+            self.raw.seek(offset)
+            self.stream = self.raw
+            self.position = offset
+            return
+
+        compressed_offset, block_start = self.blocks[bisect_right(self.block_starts, offset) - 1]
+        self.raw.seek(compressed_offset)
+        if self.codec == CODEC_ZSTD:
+            self.stream = zstandard.ZstdDecompressor().stream_reader(self.raw, read_across_frames=True)
+        else:
+            self.stream = gzip.GzipFile(fileobj=self.raw, mode="rb")
+        self.position = block_start
+        self.skip(offset - block_start)
+
+    def skip(self, length):
+        while length > 0:
+            length -= len(self.read(min(length, COMPRESSION_BLOCK_SIZE)))
+
+    def read(self, size):
+        data = self.stream.read(size)
+        if not data:
+            raise EOFError("Unexpected end of archive data")
+        self.position += len(data)
+        return data
+
+    def extract(self, names, destination, progress=None, hashes=None, copies=None):
+        """Restores just the named members, visiting them in archive order.
+
+        copies maps further names to the member whose content is restored under them.
+        """
+        by_name = {member["name"]: member for member in self.index["members"]}
+        jobs = [(name, by_name[name]) for name in names if name in by_name]
+        jobs += [(name, by_name[source]) for name, source in (copies or {}).items()]
+        with ParallelExtractor(destination, progress, hashes=hashes) as extractor:
+            for name, record in sorted(jobs, key=lambda job: job[1]["offset"]):
+                if record["type"] == "dir":
+                    extractor.add_directory(name, record["mode"], record["mtime"])
+                elif record["type"] == "symlink":
+                    extractor.add_symlink(name, record["linkname"])
+                elif record["type"] == "hardlink" and record["linkname"] in by_name and record["linkname"] not in names:
+                    # The target is not being restored, so restore its content under this name
+                    self.extract_file(extractor, name, by_name[record["linkname"]])
+                elif record["type"] == "hardlink":
+                    extractor.add_hardlink(name, record["linkname"])
+                else:
+                    self.extract_file(extractor, name, record)
+        return len(jobs)
+
+    def extract_file(self, extractor, name, record):
+        if "sparse" in record:
+            self.seek(record["offset"] + record["map_size"])
+            extractor.add_sparse_file(name, record["mode"], record["mtime"], record["realsize"], record["sparse"], self)
+        else:
+            self.seek(record["offset"])
+            extractor.add_file(name, record["mode"], record["mtime"], record["size"], self)
+
+def list_backup_contents(backup, location):
+    """Returns [(name, size)] for a backup id from list_backups, from its snapshot or sidecars without opening the archive."""
+    if backup.startswith(SNAPSHOT_ID_PREFIX):
+        files = ChunkStore(Path(location) / STORE_DIRNAME).load_snapshot(backup[len(SNAPSHOT_ID_PREFIX):])["files"]
+    else:
+        files = (load_manifest(Path(location) / backup) or {}).get("files")
+    if files is not None:
+        entries = files.items()
+    else:
+        index = load_index(Path(location) / backup) or {"members": []}
+        entries = ((record["name"], record) for record in index["members"])
+    # Directories are restored along with the paths inside them, so they are not listed
+    return sorted((name, entry["size"]) for name, entry in entries if entry.get("type") != "dir")
+
+def restore_members(tar, extractor, selected, target_selected=None, copies=None, progress=None):
+    """Restores the members of a forward-only read for which selected(name) is true.
+
+    A selected hard link whose target is left out gets the target's content
+    instead. The target always comes first in a tar, so it is spooled as it
+    goes by when the writer marked it as linked (NLINK_PAX_KEY); copies maps
+    further names to the member whose content they get. Each content is
+    written once and the other names are linked to it. Returns how many
+    paths were restored and the links whose target was not marked, as
+    {target: [link names]}. Counts totals on progress if given.
+    """
+    target_selected = target_selected or selected
+    waiting = {}  # Member name -> names to restore with its content
+    for name, source in (copies or {}).items():
+        waiting.setdefault(source, []).append(name)
+    spools = {}  # Marked members left out -> (member, size, temporary file with their content)
+    stand_ins = {}  # Target name -> the path restored with its content
+    unresolved = {}
+    restored = 0
+
+    def restore_content(name, member, size, source):
+        if member.name in stand_ins:
+            extractor.add_hardlink(name, stand_ins[member.name])
+        else:
+            extractor.add_file(name, member.mode, member.mtime, size, source)
+            stand_ins[member.name] = name
+
+    try:
+        for member in tar:
+            if selected(member.name):
+                if progress is not None:
+                    progress.add_totals(1, member.size)  # The total is only known once the archive ends
+                if not member.islnk() or target_selected(member.linkname):
+                    extractor.add_member(tar, member)
+                elif member.linkname in stand_ins:
+                    extractor.add_hardlink(member.name, stand_ins[member.linkname])
+                elif member.linkname in spools:
+                    target, size, spool = spools.pop(member.linkname)
+                    spool.seek(0)
+                    restore_content(member.name, target, size, spool)
+                    spool.close()
+                else:
+                    unresolved.setdefault(member.linkname, []).append(member.name)
+                    continue
+                restored += 1
+            elif member.name in waiting:
+                size = int(member.pax_headers.get("GNU.sparse.realsize", member.size))
+                source = tar.extractfile(member)
+                for name in waiting.pop(member.name):
+                    restore_content(name, member, size, source)
+                    restored += 1
+            elif member.isreg() and int(member.pax_headers.get(NLINK_PAX_KEY, 1)) > 1:
+                os.makedirs(extractor.destination, exist_ok=True)
+                spool = tempfile.TemporaryFile(dir=extractor.destination)  # Same disk as the restore, not a tmpfs
+                shutil.copyfileobj(tar.extractfile(member), spool, COMPRESSION_BLOCK_SIZE)
+                spools[member.name] = (member, spool.tell(), spool)
+    finally:
+        for _, _, spool in spools.values():
+            spool.close()
+    return restored, unresolved
+
+def restore_selected(backup_file, names, destination, progress=None):
+    """Restores the named paths and everything inside them, following the incremental chain and seeking via each archive's index."""
+    backup_file = Path(backup_file)
+    progress = progress or ProgressCounters()
+    selection = set(names)
+    plan = resolve_restore_chain(backup_file)
+    if plan is None:
+        index = load_index(backup_file)
+        plan = {backup_file.name: {record["name"] for record in index["members"]} if index is not None else None}
+    # Without a manifest or an index the names are only known once the archive is read
+    names = {name for members in plan.values() if members is not None for name in members if wanted_member(name, selection)}
+    progress.add_totals(len(names))
+    hashes = manifest_hashes(backup_file)
+
+    # A hard link whose target is not being restored gets the target's content, which may sit in an older archive
+    copies = {}
+    files = (load_manifest(backup_file) or {"files": {}})["files"]
+    for name in names:
+        linkname = files.get(name, {}).get("linkname")
+        if linkname is not None and linkname not in names and linkname in files:
+            copies.setdefault(files[linkname]["archive"], {})[name] = linkname
+
+    copied = {name for archive_copies in copies.values() for name in archive_copies}
+
+    restored = 0
+    for archive_name in sorted(plan):
+        archive_copies = copies.get(archive_name, {})
+        wanted = None if plan[archive_name] is None else (names & plan[archive_name]) - copied
+        if wanted is not None and not wanted and not archive_copies:
+            continue
+        archive_file = backup_file.parent / archive_name
+        index = load_index(archive_file)
+        if index is None:
+            # No index: fall back to a sequential pass over the archive
+            if wanted is None:
+                selected, target_selected, counted = (lambda name: wanted_member(name, selection)), None, progress
+            else:
+                selected, target_selected, counted = wanted.__contains__, names.__contains__, None
+            with open_archive(archive_file) as tar, ParallelExtractor(destination, progress, hashes=hashes) as extractor:
+                count, unresolved = restore_members(tar, extractor, selected, target_selected, archive_copies, counted)
+                restored += count
+                if unresolved:
+                    # Targets the archive does not mark as linked: a second pass fetches their content
+                    with open_archive(archive_file) as second:
+                        restored += restore_members(second, extractor, lambda name: False, copies={
+                            name: target for target, links in unresolved.items() for name in links
+                        })[0]
+            continue
+        with IndexedArchive(archive_file, index) as archive:
+            restored += archive.extract(wanted, destination, progress, hashes, archive_copies)
+    return restored
+
+class HashingReader:
+    """File wrapper that hashes the bytes tarfile reads, so content hashes cost no extra read."""
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.hasher = hashlib.new(HASH_ALGORITHM)
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        self.hasher.update(data)
+        return data
+
+    def hexdigest(self):
+        return self.hasher.hexdigest()
+
+class RateLimiter:
+    """Token bucket that sleeps the reading thread to hold throughput near bytes_per_second."""
+
+    def __init__(self, bytes_per_second):
+        self.rate = bytes_per_second
+        self.allowance = bytes_per_second
+        self.last = time.monotonic()
+
+    def wait(self, num_bytes):
+        now = time.monotonic()
+        self.allowance = min(self.rate, self.allowance + (now - self.last) * self.rate)
+        self.last = now
+        self.allowance -= num_bytes
+        if self.allowance < 0:
+            time.sleep(-self.allowance / self.rate)
+
+class ThrottledReader:
+    """File wrapper that reads no faster than its RateLimiter allows."""
+
+    def __init__(self, fileobj, limiter):
+        self.fileobj = fileobj
+        self.limiter = limiter
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        self.limiter.wait(len(data))
+        return data
+
+class HashingWriter:
+    """File wrapper that checksums the archive bytes on their way to disk.
+
+    Every VERIFY_SEGMENT_SIZE bytes get their own digest so verification
+    can re-read the archive on all cores; the archive's own checksum is
+    the digest of those, so each byte is hashed once.
+    """
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.segment_hasher = hashlib.new(HASH_ALGORITHM)
+        self.segment_fill = 0
+        self.segments = []
+        self.size = 0
+
+    def write(self, data):
+        self.fileobj.write(data)
+        self.update(data)
+        return len(data)
+
+    def update(self, data):
+        """Accounts for bytes that reached the file some other way, such as copy_file_range."""
+        view = memoryview(data)
+        while view:
+            part = view[:VERIFY_SEGMENT_SIZE - self.segment_fill]
+            self.segment_hasher.update(part)
+            self.segment_fill += len(part)
+            view = view[len(part):]
+            if self.segment_fill == VERIFY_SEGMENT_SIZE:
+                self.finish_segment()
+        self.size += len(data)
+
+    def tell(self):
+        return self.size
+
+    def finish_segment(self):
+        self.segments.append(self.segment_hasher.hexdigest())
+        self.segment_hasher = hashlib.new(HASH_ALGORITHM)
+        self.segment_fill = 0
+
+    def checksum(self):
+        """The record saved in the index once the archive is complete."""
+        if self.segment_fill:
+            self.finish_segment()
+        return {
+            "algorithm": HASH_ALGORITHM,
+            "size": self.size,
+            "hash": hashlib.new(HASH_ALGORITHM, "".join(self.segments).encode()).hexdigest(),
+            "segment_size": VERIFY_SEGMENT_SIZE,
+            "segments": self.segments,
+        }
+
+def copy_file_data(source_fd, target_fd, size, limiter=None):
+    """Appends size bytes of source_fd to target_fd without passing them through Python.
+
+    Uses copy_file_range (which may share extents on btrfs and XFS), then
+    sendfile, then plain reads for filesystems that support neither.
+    Returns the number of bytes copied, less than size if the file shrank.
+    """
+    copied = 0
+    for method in ("copy_file_range", "sendfile"):
+        try:
+            while copied < size:
+                count = min(size - copied, ZERO_COPY_CHUNK_SIZE)
+                if method == "copy_file_range":
+                    done = os.copy_file_range(source_fd, target_fd, count, copied)
+                else:
+                    done = os.sendfile(target_fd, source_fd, copied, count)
+                if done == 0:
+                    return copied
+                copied += done
+                if limiter is not None:
+                    limiter.wait(done)
+            return copied
+        except OSError as e:
+            if copied or e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.EBADF):
+                raise
+            debug_print(f"{method} unavailable ({e}), falling back")
+    while copied < size:
+        data = os.pread(source_fd, min(size - copied, ZERO_COPY_CHUNK_SIZE), copied)
+        if not data:
+            break
+        write_all(target_fd, data)
+        copied += len(data)
+        if limiter is not None:
+            limiter.wait(len(data))
+    return copied
+
+def clone_file_data(source_fd, target_fd, size):
+    """Makes target share source's blocks (a reflink) on btrfs, XFS and the like, else copies them in the kernel."""
+    try:
+        fcntl.ioctl(target_fd, FICLONE, source_fd)
+        return size
+    except OSError as e:
+        if e.errno not in (errno.EXDEV, errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL, errno.EBADF):
+            raise
+    return copy_file_data(source_fd, target_fd, size)
+
+def data_extents(fd, size):
+    """Returns the (offset, length) data regions of a file with holes, or None if it has none or the filesystem cannot tell."""
+    extents = []
+    offset = 0
+    try:
+        while offset < size:
+            start = os.lseek(fd, offset, os.SEEK_DATA)
+            if start >= size:
+                break
+            end = min(os.lseek(fd, start, os.SEEK_HOLE), size)
+            extents.append((start, end - start))
+            offset = end
+    except OSError as e:
+        if e.errno != errno.ENXIO:  # ENXIO: only a hole is left
+            return None
+    if sum(length for _, length in extents) == size:
+        return None
+    if not extents or extents[-1][0] + extents[-1][1] < size:
+        extents.append((size, 0))  # GNU tar marks a trailing hole with an empty region at the end
+    return extents
+
+class SparseReader:
+    """Reads a sparse file as GNU sparse 1.0 member data: the map of its data regions, then only those regions."""
+
+    def __init__(self, fd, extents):
+        self.fd = fd
+        self.extents = extents
+        text = f"{len(extents)}\n" + "".join(f"{offset}\n{length}\n" for offset, length in extents)
+        padding = -len(text) % tarfile.BLOCKSIZE
+        self.map_block = text.encode("ascii") + tarfile.NUL * padding
+        self.size = len(self.map_block) + sum(length for _, length in extents)
+        self.blocks = self.iter_blocks()
+        self.buffer = b""
+
+    def iter_blocks(self):
+        yield self.map_block
+        for offset, length in self.extents:
+            end = offset + length
+            while offset < end:
+                data = os.pread(self.fd, min(end - offset, COMPRESSION_BLOCK_SIZE), offset)
+                if not data:
+                    debug_print("File shrank during backup, padding with zeros")
+                    data = tarfile.NUL * min(end - offset, COMPRESSION_BLOCK_SIZE)
+                offset += len(data)
+                yield data
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buffer) < size:
+            block = next(self.blocks, None)
+            if block is None:
+                break
+            self.buffer += block
+        if size < 0:
+            size = len(self.buffer)
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+def sparse_tarinfo(tarinfo, reader):
+    """Turns a regular file's TarInfo into a GNU sparse 1.0 member that tarfile and GNU tar both restore with holes."""
+    realsize = tarinfo.size
+    tarinfo.pax_headers.update({
+        "GNU.sparse.major": "1",
+        "GNU.sparse.minor": "0",
+        "GNU.sparse.name": tarinfo.name,
+        "GNU.sparse.realsize": str(realsize),
+    })
+    # A short ASCII placeholder, so tarfile adds no path record that would override GNU.sparse.name
+    basename = os.path.basename(tarinfo.name)
+    if not basename.isascii() or len(basename) > 80:
+        basename = "sparse"
+    tarinfo.name = SPARSE_NAME_PREFIX + basename
+    tarinfo.size = reader.size
+
+def hash_file_region(fd, offset, length, *hashers):
+    """Feeds a region of a file to hashers through mmap windows, so no bytes are copied into Python."""
+    end = offset + length
+    while offset < end:
+        start = offset - offset % mmap.ALLOCATIONGRANULARITY
+        window = min(end, start + ZERO_COPY_CHUNK_SIZE) - start
+        with mmap.mmap(fd, window, access=mmap.ACCESS_READ, offset=start) as mapped, memoryview(mapped) as whole:
+            with whole[offset - start:] as view:
+                for hasher in hashers:
+                    hasher.update(view)
+        offset = start + window
+
+# Folder tree helpers
+def list_subdirectories(path, excluded=EXCLUDED_ITEMS):
+    """Returns sorted (name, path) pairs of the non-excluded subdirectories, using scandir's d_type."""
+    try:
+        with os.scandir(path) as it:
+            return sorted(
+                (entry.name, entry.path)
+                for entry in it
+                if entry.is_dir(follow_symlinks=False) and entry.name not in excluded
+            )
+    except (PermissionError, FileNotFoundError) as e:
+        debug_print(f"Cannot list {path}: {e}")
+        return []
+
+def directory_size(path):
+    total = 0
+    stack = [path]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    else:
+                        total += entry.stat(follow_symlinks=False).st_size
+        except (PermissionError, FileNotFoundError):
+            continue
+    return total
+
+class FolderSizeCache:
+    """Folder sizes kept between launches, so the tree shows the last known size immediately."""
+
+    def __init__(self, path=FOLDER_SIZE_CACHE):
+        self.path = Path(path)
+        self.lock = Lock()
+        self.dirty = False
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.sizes = json.load(f)
+        except (OSError, ValueError):
+            self.sizes = {}
+
+    def get(self, folder):
+        with self.lock:
+            return self.sizes.get(folder)
+
+    def set(self, folder, size):
+        with self.lock:
+            self.dirty = self.dirty or self.sizes.get(folder) != size
+            self.sizes[folder] = size
+
+    def save(self):
+        with self.lock:
+            if not self.dirty:
+                return
+            sizes = dict(self.sizes)
+            self.dirty = False
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            write_json_atomic(self.path, sizes)
+        except OSError as e:
+            debug_print(f"Failed to save folder size cache: {e}")
+
+# Content-addressed deduplicating store
+def find_chunk_boundary(buffer):
+    """Content-defined cut point: the first byte past CHUNK_MIN_SIZE where the gear hash matches CHUNK_CUT.
+
+    With one-bit gear entries, h = (h << 1) + CHUNK_GEAR[byte] masked to
+    len(CHUNK_CUT) bits is just the table bits of the last bytes, so
+    bytes.translate and find evaluate the rolling hash in C instead of a
+    per-byte Python loop. Boundaries depend only on nearby content and
+    survive insertions earlier in the file.
+    """
+    if len(buffer) <= CHUNK_MIN_SIZE:
+        return len(buffer)
+    end = min(len(buffer), CHUNK_MAX_SIZE)
+    start = CHUNK_MIN_SIZE - len(CHUNK_CUT)
+    while start <= end - len(CHUNK_CUT):
+        stop = min(end, start + CHUNK_SCAN_SIZE)
+        position = buffer[start:stop].translate(CHUNK_GEAR).find(CHUNK_CUT)
+        if position != -1:
+            return start + position + len(CHUNK_CUT)
+        start = stop - len(CHUNK_CUT) + 1  # Windows straddling the step are searched in the next one
+    return end
+
+def iter_chunks(fileobj):
+    buffer = bytearray()
+    while True:
+        data = fileobj.read(CHUNK_MAX_SIZE)
+        buffer += data
+        while buffer and (len(buffer) >= CHUNK_MAX_SIZE or not data):
+            cut = find_chunk_boundary(buffer)
+            yield bytes(buffer[:cut])
+            del buffer[:cut]
+        if not data:
+            return
+
+class ChunkStore:
+    """Repository of zlib-compressed chunks named by their BLAKE2 hash, plus JSON snapshot manifests."""
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self.chunks_dir = self.root / "chunks"
+        self.snapshots_dir = self.root / "snapshots"
+        self.limiter = None  # Optional RateLimiter for reading source files
+        self._index = None
+        self.hardlinks = {}  # (device, inode) -> arcname of the first stored path of a multiply linked file
+        self.new_chunks = 0
+        self.new_bytes = 0
+
+    def open(self):
+        self.chunks_dir.mkdir(parents=True, exist_ok=True)
+        self.snapshots_dir.mkdir(parents=True, exist_ok=True)
+        return self
+
+    @contextmanager
+    def locked(self, exclusive=False):
+        """Holds the store's lock across processes: shared while snapshots reuse chunks, exclusive to delete any."""
+        self.root.mkdir(parents=True, exist_ok=True)
+        with open(self.root / STORE_LOCK_FILENAME, "a") as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            self._index = None  # Chunks may have been added or removed while waiting for the lock
+            try:
+                yield self
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    @property
+    def index(self):
+        # Hash index of every stored chunk, loaded once from the chunk directory
+        if self._index is None:
+            self._index = set()
+            if self.chunks_dir.exists():
+                for bucket in os.scandir(self.chunks_dir):
+                    self._index.update(entry.name for entry in os.scandir(bucket.path) if not entry.name.endswith(".tmp"))
+        return self._index
+
+    def chunk_path(self, chunk_id):
+        return self.chunks_dir / chunk_id[:2] / chunk_id
+
+    def put_chunk(self, data):
+        chunk_id = hashlib.blake2b(data, digest_size=32).hexdigest()
+        if chunk_id in self.index:
+            return chunk_id
+        path = self.chunk_path(chunk_id)
+        path.parent.mkdir(exist_ok=True)
+        tmp_path = path.with_name(path.name + ".tmp")
+        compressed = zlib.compress(data, 6)
+        with open(tmp_path, "wb") as f:
+            f.write(compressed)
+        os.replace(tmp_path, path)
+        self.index.add(chunk_id)
+        self.new_chunks += 1
+        self.new_bytes += len(compressed)
+        return chunk_id
+
+    def get_chunk(self, chunk_id):
+        with open(self.chunk_path(chunk_id), "rb") as f:
+            return zlib.decompress(f.read())
+
+    def snapshot_entry(self, entry, previous=None):
+        """Stores one scanned file and returns its snapshot record; unchanged files reuse their chunk list."""
+        stat_result = entry.stat
+        record = {
+            "mode": stat.S_IMODE(stat_result.st_mode),
+            "mtime": stat_result.st_mtime_ns,
+            "size": stat_result.st_size,
+            "inode": stat_result.st_ino,
+        }
+        inode = (stat_result.st_dev, stat_result.st_ino)
+        if stat.S_ISDIR(stat_result.st_mode):
+            record["type"] = "dir"
+        elif stat.S_ISLNK(stat_result.st_mode):
+            record["type"] = "symlink"
+            record["linkname"] = os.readlink(entry.path)
+        elif stat.S_ISREG(stat_result.st_mode) and stat_result.st_nlink > 1 and inode in self.hardlinks:
+            record["type"] = "hardlink"
+            record["linkname"] = self.hardlinks[inode]
+        elif stat.S_ISREG(stat_result.st_mode):
+            record["type"] = "file"
+            if stat_result.st_nlink > 1:
+                self.hardlinks[inode] = entry.arcname
+            if manifest_entry_unchanged(previous, stat_result) and previous.get("type") == "file":
+                record["chunks"] = previous["chunks"]
+            else:
+                with open(entry.path, "rb") as f:
+                    source = ThrottledReader(f, self.limiter) if self.limiter is not None else f
+                    record["chunks"] = [self.put_chunk(chunk) for chunk in iter_chunks(source)]
+        else:
+            return None
+        return record
+
+    def list_snapshots(self):
+        if not self.snapshots_dir.exists():
+            return []
+        return sorted(path.stem for path in self.snapshots_dir.glob(f"{SNAPSHOT_PREFIX}*.json"))
+
+    def load_snapshot(self, name):
+        with open(self.snapshots_dir / f"{name}.json", "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def save_snapshot(self, snapshot):
+        # The snapshot only exists once all its chunks are stored
+        write_json_atomic(self.snapshots_dir / f"{snapshot['name']}.json", snapshot)
+
+    def latest_snapshot(self):
+        snapshots = self.list_snapshots()
+        return self.load_snapshot(snapshots[-1]) if snapshots else None
+
+    def restore_snapshot(self, name, destination, progress=None, names=None):
+        """Restores a snapshot, or only the named paths and everything inside them.
+
+        Hard links are made once every file is written, and folder modes and
+        times are applied last, deepest first, like ParallelExtractor.finish.
+        """
+        instruments = progress.instruments if progress else NO_INSTRUMENTATION
+        snapshot_files = self.load_snapshot(name)["files"]
+        files = snapshot_files
+        if names is not None:
+            files = {arcname: record for arcname, record in files.items() if wanted_member(arcname, names)}
+        if progress:
+            progress.add_totals(len(files), sum(record["size"] for record in files.values() if record["type"] != "dir"))
+        links, directories = [], []
+        for arcname, record in sorted(files.items()):
+            started = time.perf_counter()
+            target = Path(destination) / arcname
+            size = 0 if record["type"] == "dir" else record["size"]
+            if record["type"] == "dir":
+                target.mkdir(parents=True, exist_ok=True)
+                directories.append((target, record))
+            else:
+                target.parent.mkdir(parents=True, exist_ok=True)
+                if target.is_symlink() or (record["type"] == "symlink" and target.exists()):
+                    target.unlink()
+            if record["type"] == "symlink":
+                os.symlink(record["linkname"], target)
+            elif record["type"] == "hardlink" and record["linkname"] in files:
+                links.append((Path(destination) / record["linkname"], target))
+            elif record["type"] != "dir":
+                # A hard link whose target is not being restored gets the target's content
+                source = snapshot_files[record["linkname"]] if record["type"] == "hardlink" else record
+                self.write_file(target, source)
+            instruments.file_done("write", arcname, started, size)
+            if progress:
+                progress.add(1, size)
+
+        for source, target in links:
+            if os.path.lexists(target):
+                os.unlink(target)
+            os.link(source, target)
+        for target, record in sorted(directories, key=lambda d: len(d[0].parts), reverse=True):
+            os.chmod(target, record["mode"])
+            os.utime(target, ns=(record["mtime"], record["mtime"]))
+
+    def write_file(self, target, record):
+        with open(target, "wb") as f:
+            for chunk_id in record["chunks"]:
+                data = self.get_chunk(chunk_id)
+                if data.count(0) == len(data):
+                    f.seek(len(data), os.SEEK_CUR)  # Leave a hole, as a sparse source file had
+                else:
+                    f.write(data)
+            f.truncate()
+        os.chmod(target, record["mode"])
+        os.utime(target, ns=(record["mtime"], record["mtime"]))
+
+    def prune(self, keep_last):
+        """Deletes all but the newest keep_last snapshots and returns their names."""
+        snapshots = self.list_snapshots()
+        removed = snapshots[: max(len(snapshots) - keep_last, 0)]
+        for name in removed:
+            self.remove_snapshot(name)
+        return removed
+
+    def remove_snapshot(self, name):
+        (self.snapshots_dir / f"{name}.json").unlink()
+        for suffix in (REPORT_SUFFIX, PROFILE_SUFFIX, TRACE_SUFFIX):
+            sidecar_path(self.root / "reports" / name, suffix).unlink(missing_ok=True)
+
+    def collect_garbage(self):
+        """Deletes chunks no snapshot references; returns (chunks removed, bytes freed)."""
+        referenced = set()
+        for name in self.list_snapshots():
+            for record in self.load_snapshot(name)["files"].values():
+                referenced.update(record.get("chunks", ()))
+
+        removed, freed = 0, 0
+        for chunk_id in list(self.index - referenced):
+            path = self.chunk_path(chunk_id)
+            freed += path.stat().st_size
+            path.unlink()
+            self.index.discard(chunk_id)
+            removed += 1
+        return removed, freed
+
+# Persistent catalog of the backups in a save location
+def backup_timestamp(name):
+    """The datetime embedded in a backup or snapshot name, or None."""
+    stem = name.split(".", 1)[0]
+    for prefix in (BACKUP_PREFIX, SNAPSHOT_PREFIX):
+        if stem.startswith(prefix):
+            try:
+                return datetime.strptime(stem[len(prefix):], "%Y-%m-%d_%H-%M-%S")
+            except ValueError:
+                return None
+    return None
+
+def backup_created(name, fallback_mtime):
+    """Reads the timestamp embedded in a backup name, falling back to the file's mtime."""
+    created = backup_timestamp(name)
+    if created is not None:
+        return created.isoformat(sep=" ")
+    return datetime.fromtimestamp(fallback_mtime).isoformat(sep=" ", timespec="seconds")
+
+def contained_items(names):
+    """The BACKUP_ITEMS keys that the given archive member names fall under."""
+    return sorted({name.split("/", 1)[0] for name in names} & set(BACKUP_ITEMS))
+
+class BackupCatalog:
+    """SQLite catalog of the archives and snapshots in a save location.
+
+    Rows are only re-read from sidecars when an archive's size or mtime
+    changes, so listing hundreds of multi-GB backups never opens them.
+    """
+
+    def __init__(self, location):
+        self.location = Path(location)
+        self.lock = Lock()
+        try:
+            self.connection = sqlite3.connect(self.location / CATALOG_FILENAME, check_same_thread=False)
+            self.create_schema()
+        except sqlite3.Error as e:
+            # Read-only or missing folder: keep working from a throwaway in-memory catalog
+            debug_print(f"Using an in-memory backup catalog: {e}")
+            self.connection = sqlite3.connect(":memory:", check_same_thread=False)
+            self.create_schema()
+
+    def create_schema(self):
+        with self.lock, self.connection:
+            if self.connection.execute("PRAGMA user_version").fetchone()[0] != CATALOG_VERSION:
+                self.connection.execute("DROP TABLE IF EXISTS backups")
+            self.connection.execute(
+                """CREATE TABLE IF NOT EXISTS backups (
+                    id TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    created TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    item_count INTEGER,
+                    codec TEXT,
+                    backup_type TEXT,
+                    items TEXT NOT NULL
+                )"""
+            )
+            self.connection.execute(f"PRAGMA user_version = {CATALOG_VERSION}")
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def candidates(self):
+        """Yields (backup id, path, kind) for every backup on disk, using scandir rather than glob."""
+        if not self.location.is_dir():
+            return
+        with os.scandir(self.location) as it:
+            for entry in it:
+                if entry.name.endswith(ARCHIVE_EXTENSIONS) and entry.is_file():
+                    yield entry.name, Path(entry.path), "archive"
+        snapshots_dir = self.location / STORE_DIRNAME / "snapshots"
+        if snapshots_dir.is_dir():
+            with os.scandir(snapshots_dir) as it:
+                for entry in it:
+                    if entry.name.startswith(SNAPSHOT_PREFIX) and entry.name.endswith(".json"):
+                        yield f"{SNAPSHOT_ID_PREFIX}{entry.name[:-5]}", Path(entry.path), "snapshot"
+
+    def describe(self, backup_id, path, kind, stat_result):
+        """Builds a catalog row from the backup's sidecars without opening the archive itself."""
+        item_count, backup_type, names = None, None, []
+        size = stat_result.st_size
+        if kind == "snapshot":
+            with open(path, "r", encoding="utf-8") as f:
+                files = json.load(f)["files"]
+            item_count, codec, backup_type, names = len(files), "dedup", "snapshot", files
+            # What it restores, each hard linked file once; its chunks are shared with other snapshots
+            size = sum(record["size"] for record in files.values() if record["type"] not in ("dir", "hardlink"))
+        else:
+            codec = next((codec for codec, extension in CODEC_EXTENSIONS.items() if path.name.endswith(extension)), None)
+            manifest = load_manifest(path)
+            if manifest is not None:
+                item_count, backup_type, names = len(manifest["files"]), manifest.get("type"), manifest["files"]
+            else:
+                index = load_index(path)
+                if index is not None:
+                    names = [record["name"] for record in index["members"]]
+                    item_count = len(names)
+        return (
+            backup_id,
+            kind,
+            backup_created(path.name, stat_result.st_mtime),
+            size,
+            stat_result.st_mtime_ns,
+            item_count,
+            codec,
+            backup_type,
+            json.dumps(contained_items(names)),
+        )
+
+    def refresh(self):
+        """Syncs the catalog with the folder; returns True when anything changed."""
+        with self.lock:
+            known = {row[0]: row[1:] for row in self.connection.execute("SELECT id, size, mtime_ns FROM backups")}
+        rows, seen = [], set()
+        for backup_id, path, kind in self.candidates():
+            seen.add(backup_id)
+            try:
+                stat_result = path.stat()
+                known_size, known_mtime = known.get(backup_id, (None, None))
+                # A snapshot's size is that of its files, so only its mtime tells whether it was rewritten
+                if known_mtime == stat_result.st_mtime_ns and (kind == "snapshot" or known_size == stat_result.st_size):
+                    continue
+                rows.append(self.describe(backup_id, path, kind, stat_result))
+            except (OSError, ValueError, KeyError) as e:
+                debug_print(f"Cannot catalog {path}: {e}")
+        removed = set(known) - seen
+        with self.lock, self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO backups VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            self.connection.executemany("DELETE FROM backups WHERE id = ?", [(backup_id,) for backup_id in removed])
+        return bool(rows or removed)
+
+    def record(self, path):
+        """Adds or updates one backup right after it was written."""
+        path = Path(path)
+        if path.name.startswith(SNAPSHOT_PREFIX):
+            backup_id, kind = f"{SNAPSHOT_ID_PREFIX}{path.stem}", "snapshot"
+        else:
+            backup_id, kind = path.name, "archive"
+        row = self.describe(backup_id, path, kind, path.stat())
+        with self.lock, self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO backups VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", row)
+
+    def query(self, sort="newest", text=None):
+        """Returns catalog rows as dicts, sorted by one of CATALOG_SORTS and filtered by name or item."""
+        sql = "SELECT id, kind, created, size, item_count, codec, backup_type, items FROM backups"
+        params = []
+        if text:
+            sql += " WHERE id LIKE ? OR items LIKE ?"
+            params = [f"%{text}%", f"%{text}%"]
+        sql += f" ORDER BY {CATALOG_SORTS[sort]}"
+        with self.lock:
+            rows = self.connection.execute(sql, params).fetchall()
+        keys = ("id", "kind", "created", "size", "item_count", "codec", "backup_type", "items")
+        entries = [dict(zip(keys, row)) for row in rows]
+        for entry in entries:
+            entry["items"] = json.loads(entry["items"])
+        return entries
+
+def catalog_label(entry):
+    name = entry["id"][len(SNAPSHOT_ID_PREFIX):] if entry["kind"] == "snapshot" else entry["id"]
+    details = [entry["created"], format_size(entry["size"])]
+    if entry["item_count"] is not None:
+        details.append(f"{entry['item_count']} files")
+    details.append(entry["backup_type"] or entry["codec"] or "tar")
+    return f"{name} ({', '.join(details)})"
+
+def update_catalog(location, path):
+    try:
+        with BackupCatalog(location) as catalog:
+            catalog.record(path)
+    except (OSError, sqlite3.Error) as e:
+        debug_print(f"Failed to update the backup catalog: {e}")
+
+# Background service helpers
+def lower_priority(niceness=DAEMON_NICENESS):
+    """Drops the process to the given nice level and the idle I/O class; returns whether ioprio was set.
+
+    Linux applies both per thread and new threads inherit them, so call this
+    before any worker pool starts.
+    """
+    try:
+        os.nice(max(0, niceness - os.nice(0)))
+    except OSError as e:
+        debug_print(f"Cannot change nice level: {e}")
+    syscall = IOPRIO_SET_SYSCALLS.get(platform.machine())
+    if syscall is None:
+        debug_print(f"ioprio_set is not known on {platform.machine()}")
+        return False
+    libc = ctypes.CDLL(None, use_errno=True)
+    if libc.syscall(syscall, IOPRIO_WHO_PROCESS, 0, IOPRIO_CLASS_IDLE << IOPRIO_CLASS_SHIFT) != 0:
+        debug_print(f"ioprio_set failed: {os.strerror(ctypes.get_errno())}")
+        return False
+    return True
+
+def system_idle(max_load):
+    """Whether the one-minute load average is at or below max_load."""
+    return os.getloadavg()[0] <= max_load
+
+def retention_keep(names, keep_last=0, keep_daily=0, keep_weekly=0, keep_monthly=0):
+    """Picks the backup names a keep-last/daily/weekly/monthly policy retains.
+
+    Like borg prune, each period keeps its newest backup, for the most
+    recent keep_* periods that have one.
+    """
+    dated = sorted(((backup_timestamp(name), name) for name in names if backup_timestamp(name)), reverse=True)
+    keep = {name for _, name in dated[:keep_last]}
+    for count, period in (
+        (keep_daily, lambda when: when.date()),
+        (keep_weekly, lambda when: when.isocalendar()[:2]),
+        (keep_monthly, lambda when: (when.year, when.month)),
+    ):
+        seen = set()
+        for when, name in dated:
+            if len(seen) >= count:
+                break
+            if period(when) not in seen:
+                seen.add(period(when))
+                keep.add(name)
+    return keep
+
+def thin_backups(location, keep_last=0, keep_daily=0, keep_weekly=0, keep_monthly=0):
+    """Deletes archives and snapshots the retention policy does not keep; returns the removed ids.
+
+    Archives an incremental still depends on are always kept, and chunks
+    no remaining snapshot uses are garbage collected.
+    """
+    if not any((keep_last, keep_daily, keep_weekly, keep_monthly)):
+        return []  # No policy means keep everything
+    location = Path(location)
+    removed = []
+    archives = [path.name for path in location.glob(f"{BACKUP_PREFIX}*") if path.name.endswith(ARCHIVE_EXTENSIONS)]
+    keep = retention_keep(archives, keep_last, keep_daily, keep_weekly, keep_monthly)
+    for name in list(keep):
+        parent = name
+        while parent:
+            keep.add(parent)
+            try:
+                parent = (load_manifest(location / parent) or {}).get("parent")
+            except (OSError, ValueError) as e:
+                debug_print(f"Cannot read the manifest of {parent}: {e}")
+                break
+    for name in sorted(set(archives) - keep):
+        for suffix in ("", MANIFEST_SUFFIX, INDEX_SUFFIX, REPORT_SUFFIX, PROFILE_SUFFIX, TRACE_SUFFIX):
+            sidecar_path(location / name, suffix).unlink(missing_ok=True)
+        removed.append(name)
+
+    store = ChunkStore(location / STORE_DIRNAME)
+    if store.list_snapshots():
+        # Waits for any snapshot still being written, whose chunks no saved snapshot references yet
+        with store.locked(exclusive=True):
+            snapshots = store.list_snapshots()
+            keep = retention_keep(snapshots, keep_last, keep_daily, keep_weekly, keep_monthly)
+            pruned = sorted(set(snapshots) - keep)
+            for name in pruned:
+                store.remove_snapshot(name)
+                removed.append(f"{SNAPSHOT_ID_PREFIX}{name}")
+            if pruned:
+                store.collect_garbage()
+    return removed
+
+def latest_backup_time(location):
+    """When the newest archive or snapshot in location was made, or None."""
+    times = [backup_timestamp(path.name) for path in Path(location).glob(f"{BACKUP_PREFIX}*") if path.name.endswith(ARCHIVE_EXTENSIONS)]
+    times += [backup_timestamp(name) for name in ChunkStore(Path(location) / STORE_DIRNAME).list_snapshots()]
+    times = [when for when in times if when is not None]
+    return max(times) if times else None
+
+# Backup and restore entry points shared by the GUI and the command line
+BackupResult = namedtuple("BackupResult", ["path", "summary"])
+
+class BackupAborted(Exception):
+    pass
+
+class BackupSettings:
+    """Everything a backup run needs besides the item selection."""
+
+    def __init__(
+        self,
+        save_location=DEFAULT_SAVE_LOCATION,
+        compression_enabled=True,
+        codec=CODEC_GZIP,
+        level=None,
+        workers=DEFAULT_COMPRESSION_WORKERS,
+        incremental=False,
+        backup_format=FORMAT_ARCHIVE,
+        exclusions=None,
+        bandwidth_limit=None,
+    ):
+        self.save_location = Path(save_location)
+        self.compression_enabled = compression_enabled
+        self.codec = codec
+        self.level = level if level is not None else CODEC_LEVELS[codec][2]
+        self.workers = workers
+        self.incremental = incremental
+        self.backup_format = backup_format
+        self.exclusions = exclusions if exclusions is not None else ExclusionRules()
+        self.bandwidth_limit = bandwidth_limit or None  # Bytes per second read from the source files
+
+    def archive_extension(self):
+        return CODEC_EXTENSIONS[self.codec] if self.compression_enabled else "tar"
+
+def default_backup_items(home=None, excluded=EXCLUDED_ITEMS):
+    """Every existing BACKUP_ITEMS entry, with recursive items expanded to their non-excluded subfolders."""
+    home = Path(home or Path.home())
+    items = []
+    for item, recursive in BACKUP_ITEMS.items():
+        full_path = home / item
+        if recursive == "recursive" and full_path.is_dir():
+            items.extend(path for _, path in list_subdirectories(full_path, excluded))
+        elif full_path.exists():
+            items.append(str(full_path))
+    return items
+
+def timestamp_now():
+    return datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+
+class ArchiveWriter:
+    """Writes one backup archive together with its manifest and index sidecars.
+
+    The archive is written to a .partial file next to a .journal. Each
+    checkpoint seals the data written so far (whole compressed blocks, whole
+    tar members) and appends the entries it holds to the journal, so an
+    interrupted backup can be picked up again from its last checkpoint.
+    """
+
+    def __init__(self, backup_file, settings, parent_file=None, parent_manifest=None, journal=None, stream=None, instruments=None):
+        # A stream (stdout, a pipe) is written in one forward pass with no sidecars, journal or per-file records
+        self.stream = stream
+        self.backup_file = Path(backup_file) if backup_file is not None else None
+        if stream is None:
+            self.partial_file = sidecar_path(self.backup_file, PARTIAL_SUFFIX)
+            self.journal_file = sidecar_path(self.backup_file, JOURNAL_SUFFIX)
+        self.settings = settings
+        self.instruments = instruments or NO_INSTRUMENTATION
+        self.parent_files = parent_manifest["files"] if parent_manifest else {}
+        self.manifest = {
+            "version": MANIFEST_VERSION,
+            "archive": self.backup_file.name if stream is None else None,
+            "type": "incremental" if parent_manifest else "full",
+            "parent": parent_file.name if parent_file else None,
+            "created": journal["header"]["created"] if journal else timestamp_now(),
+            "hash": HASH_ALGORITHM,
+            "files": {},
+            "deleted": [],
+        }
+        self.index = {
+            "version": INDEX_VERSION,
+            "codec": settings.codec if settings.compression_enabled else None,
+            "block_size": COMPRESSION_BLOCK_SIZE,
+            "blocks": [],
+            "members": [],
+            "checksum": None,
+        }
+        self.committed = set()  # Paths already in the archive before a resume
+        self.hardlinks = {}  # (device, inode) -> arcname of the first stored path of a multiply linked file
+        self.parent_inodes = None  # Inode -> paths stored as files in the parent manifest, built when first needed
+        self.journal_names = []  # Manifest entries added since the last checkpoint
+        self.journal_members = 0
+        self.journal_blocks = 0
+        self.bytes_since_checkpoint = 0
+        self.last_checkpoint = time.monotonic()
+
+        # Readable too, so bodies copied in the kernel can be hashed back through mmap
+        if journal:
+            checkpoint = journal["checkpoint"]
+            archive = open(self.partial_file, "r+b")
+            lock_partial(archive)
+            archive.truncate(checkpoint["archive_size"])  # Drop whatever was written after the checkpoint
+            archive.seek(0, os.SEEK_END)
+        elif stream is not None:
+            archive = stream
+        else:
+            archive = open(self.partial_file, "w+b")
+            lock_partial(archive)
+        self.output = HashingWriter(archive)
+        self.zero_copy = not settings.compression_enabled and stream is None
+        # Copied bodies get their file digest and the archive's segment digests side by side
+        self.hash_pool = ThreadPoolExecutor(max_workers=1) if self.zero_copy else None
+        self.limiter = RateLimiter(settings.bandwidth_limit) if settings.bandwidth_limit else None
+        if settings.compression_enabled:
+            self.sink = ParallelCompressor(self.output, settings.codec, settings.level, settings.workers, self.instruments)
+        else:
+            self.sink = self.output
+
+        if journal:
+            hash_file_region(archive.fileno(), 0, checkpoint["archive_size"], self.output)
+            self.committed = set(journal["files"])
+            self.manifest["files"].update(journal["files"])
+            self.index["members"] = journal["members"]
+            self.journal_members = len(journal["members"])
+            if isinstance(self.sink, ParallelCompressor):
+                self.sink.resume_at(checkpoint["archive_size"], checkpoint["tar_offset"], journal["blocks"])
+                self.journal_blocks = len(journal["blocks"])
+        self.tar = tarfile.open(fileobj=self.sink, mode="w")
+
+    def start_journal(self, items, home):
+        """Records what is being backed up, so a resume can pick up the same job."""
+        header = {
+            "version": JOURNAL_VERSION,
+            "archive": self.backup_file.name,
+            "created": self.manifest["created"],
+            "parent": self.manifest["parent"],
+            "codec": self.index["codec"],
+            "level": self.settings.level,
+            "items": list(items),
+            "home": str(home),
+            "exclusions": self.settings.exclusions.to_dict(),
+        }
+        with open(self.journal_file, "w", encoding="utf-8") as f:
+            f.write(json.dumps(header) + "\n")
+
+    def add(self, entry):
+        """Adds one scanned file to the archive unless the parent manifest shows it unchanged."""
+        if entry.arcname in self.committed:
+            # Stored before the backup was interrupted; a second copy would race the first on restore
+            return False
+
+        previous = self.parent_files.get(entry.arcname)
+        inode = (entry.stat.st_dev, entry.stat.st_ino)
+        if manifest_entry_unchanged(previous, entry.stat):
+            if previous.get("type") == "file" and entry.stat.st_nlink > 1:
+                self.hardlinks.setdefault(inode, entry.arcname)  # Later links to it can point into the older archive
+            elif previous.get("type") == "hardlink" and inode not in self.hardlinks:
+                self.find_unchanged_link(entry, inode)  # Its target may only come later in the scan
+            # A link is only reused while its target is still the first path of the inode in this backup
+            if previous.get("type") != "hardlink" or previous.get("linkname") == self.hardlinks.get(inode):
+                self.manifest["files"][entry.arcname] = previous  # Content lives in an older archive of the chain
+                self.journal_names.append(entry.arcname)
+                self.instruments.count("unchanged files")
+                return False
+
+        tarinfo = tarinfo_from_stat(entry.path, entry.arcname, entry.stat)
+        if tarinfo is None:
+            return False
+
+        if tarinfo.isreg() and entry.stat.st_nlink > 1 and inode not in self.hardlinks:
+            self.find_unchanged_link(entry, inode)
+        if tarinfo.isreg() and entry.stat.st_nlink > 1 and inode in self.hardlinks:
+            tarinfo.type = tarfile.LNKTYPE
+            tarinfo.linkname = self.hardlinks[inode]
+            tarinfo.size = 0
+            self.instruments.count("hard links")
+        elif tarinfo.isreg() and entry.stat.st_nlink > 1:
+            tarinfo.pax_headers[NLINK_PAX_KEY] = str(entry.stat.st_nlink)
+
+        file_hash = None
+        extents = None
+        # Fewer allocated blocks than the size says there are holes worth looking for
+        may_be_sparse = tarinfo.size >= SPARSE_MIN_SIZE and entry.stat.st_blocks * 512 < tarinfo.size
+        if tarinfo.isreg() and self.zero_copy and tarinfo.size >= ZERO_COPY_MIN_SIZE and not may_be_sparse:
+            file_hash = self.add_file_zero_copy(entry.path, tarinfo)
+            self.instruments.count("zero-copy files")
+        elif tarinfo.isreg():
+            with open(entry.path, "rb") as f:
+                source = f
+                extents = data_extents(f.fileno(), tarinfo.size) if may_be_sparse else None
+                if extents is not None:
+                    source = SparseReader(f.fileno(), extents)
+                    sparse_tarinfo(tarinfo, source)
+                    self.instruments.count("sparse files")
+                    self.instruments.count("sparse hole bytes", entry.stat.st_size - sum(length for _, length in extents))
+                reader = HashingReader(ThrottledReader(source, self.limiter) if self.limiter is not None else source)
+                self.tar.addfile(tarinfo, reader)
+                file_hash = reader.hexdigest()
+        else:
+            self.tar.addfile(tarinfo)
+        if tarinfo.isreg() and entry.stat.st_nlink > 1:
+            self.hardlinks[inode] = entry.arcname
+        if self.stream is not None:
+            self.tar.members.clear()  # Never read back; memory stays flat however many files stream past
+            return True
+        # tarfile pads member data to whole blocks, so the data starts that far before the new offset
+        data_offset = self.tar.offset - (tarinfo.size + tarfile.BLOCKSIZE - 1) // tarfile.BLOCKSIZE * tarfile.BLOCKSIZE
+        record = index_record(tarinfo, data_offset)
+        if extents is not None:
+            # Hashes and offsets cover the member as stored: the map block, then the data regions
+            record.update(name=entry.arcname, realsize=entry.stat.st_size, map_size=len(source.map_block), sparse=extents)
+        self.index["members"].append(record)
+
+        self.manifest["files"][entry.arcname] = {
+            "type": record["type"],
+            "size": entry.stat.st_size,
+            "mtime": entry.stat.st_mtime_ns,
+            "inode": entry.stat.st_ino,
+            "hash": file_hash,
+            "archive": self.manifest["archive"],
+        }
+        if tarinfo.islnk():
+            self.manifest["files"][entry.arcname]["linkname"] = tarinfo.linkname
+        self.journal_names.append(entry.arcname)
+        self.bytes_since_checkpoint += tarinfo.size
+        return True
+
+    def find_unchanged_link(self, entry, inode):
+        """Registers an unchanged path of a new link's inode before the scan reaches it.
+
+        The new path then becomes a link into the older archive instead of a
+        second full copy that the unchanged path would be linked to.
+        """
+        if self.parent_inodes is None:
+            self.parent_inodes = {}
+            for name, previous in self.parent_files.items():
+                if previous.get("type") == "file":
+                    self.parent_inodes.setdefault(previous["inode"], []).append(name)
+        home = entry.path[:len(entry.path) - len(entry.arcname)]
+        for name in self.parent_inodes.get(entry.stat.st_ino, ()):
+            try:
+                stat_result = os.lstat(os.path.join(home, name))
+            except OSError:
+                continue
+            if (stat_result.st_dev, stat_result.st_ino) == inode and manifest_entry_unchanged(self.parent_files[name], stat_result):
+                self.hardlinks[inode] = name
+                self.manifest["files"][name] = self.parent_files[name]  # Kept even if the scan never reaches it
+                self.journal_names.append(name)
+                return
+
+    def add_file_zero_copy(self, path, tarinfo):
+        """Writes the header like tarfile would, then copies the body file-to-file in the kernel."""
+        header = tarinfo.tobuf(self.tar.format, self.tar.encoding, self.tar.errors)
+        self.output.write(header)
+        self.output.fileobj.flush()
+        out_fd = self.output.fileobj.fileno()
+        data_start = self.output.size
+        with open(path, "rb") as f:
+            copied = copy_file_data(f.fileno(), out_fd, tarinfo.size, self.limiter)
+        self.output.fileobj.seek(0, os.SEEK_END)  # Resync the buffered writer with the descriptor
+        if copied < tarinfo.size:
+            debug_print(f"File shrank during backup, padding with zeros: {path}")
+            self.output.fileobj.write(tarfile.NUL * (tarinfo.size - copied))
+            self.output.fileobj.flush()
+
+        # Hash what actually landed in the archive, read back from the page cache
+        hasher = hashlib.new(HASH_ALGORITHM)
+        segments = self.hash_pool.submit(hash_file_region, out_fd, data_start, tarinfo.size, self.output)
+        hash_file_region(out_fd, data_start, tarinfo.size, hasher)
+        segments.result()
+        blocks, remainder = divmod(tarinfo.size, tarfile.BLOCKSIZE)
+        if remainder:
+            self.output.write(tarfile.NUL * (tarfile.BLOCKSIZE - remainder))
+            blocks += 1
+        self.tar.offset += len(header) + blocks * tarfile.BLOCKSIZE
+        self.tar.members.append(tarinfo)
+        return hasher.hexdigest()
+
+    def checkpoint_due(self):
+        if self.stream is not None:
+            return False  # A stream cannot be resumed, so there is nothing to checkpoint
+        return self.bytes_since_checkpoint >= CHECKPOINT_BYTES or time.monotonic() - self.last_checkpoint >= CHECKPOINT_SECONDS
+
+    def checkpoint(self):
+        """Seals everything added so far and appends it to the journal."""
+        blocks = []
+        if isinstance(self.sink, ParallelCompressor):
+            self.sink.flush()
+            blocks = self.sink.blocks[self.journal_blocks:]
+            self.journal_blocks = len(self.sink.blocks)
+        self.output.fileobj.flush()
+        os.fsync(self.output.fileobj.fileno())  # The journal must never point past data that is on disk
+        record = {
+            "archive_size": self.output.size,
+            "tar_offset": self.tar.offset,
+            "blocks": blocks,
+            "members": self.index["members"][self.journal_members:],
+            "files": {name: self.manifest["files"][name] for name in self.journal_names},
+        }
+        with open(self.journal_file, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.journal_members = len(self.index["members"])
+        self.journal_names = []
+        self.bytes_since_checkpoint = 0
+        self.last_checkpoint = time.monotonic()
+
+    def close(self):
+        self.tar.close()
+        if self.hash_pool is not None:
+            self.hash_pool.shutdown()
+        if isinstance(self.sink, ParallelCompressor):
+            self.sink.close()
+            self.index["blocks"] = self.sink.blocks
+        if self.stream is not None:
+            self.stream.flush()  # The caller owns the stream
+            self.index["checksum"] = self.output.checksum()
+            return
+        self.output.fileobj.close()
+        self.index["checksum"] = self.output.checksum()
+        self.manifest["deleted"] = sorted(set(self.parent_files) - set(self.manifest["files"]))
+        save_manifest(self.backup_file, self.manifest)
+        save_index(self.backup_file, self.index)
+        # Sidecars first: an archive is only ever visible complete and described
+        os.replace(self.partial_file, self.backup_file)
+        self.journal_file.unlink(missing_ok=True)
+
+    def suspend(self, checkpoint=True):
+        """Stops writing but keeps the .partial file and journal for a later resume; a stream is just left incomplete."""
+        if checkpoint and self.stream is None:
+            self.checkpoint()
+        if isinstance(self.sink, ParallelCompressor):
+            self.sink.executor.shutdown(wait=False, cancel_futures=True)
+        if self.hash_pool is not None:
+            self.hash_pool.shutdown()
+        if self.stream is None:
+            self.output.fileobj.close()
+
+def read_journal(journal_file):
+    """Returns the header and the entries of every complete checkpoint in a backup journal."""
+    journal = {"header": None, "checkpoint": {"archive_size": 0, "tar_offset": 0}, "blocks": [], "members": [], "files": {}}
+    with open(journal_file, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break  # Torn write of the last line when the process died
+            if journal["header"] is None:
+                journal["header"] = record
+                continue
+            journal["checkpoint"] = {"archive_size": record["archive_size"], "tar_offset": record["tar_offset"]}
+            journal["blocks"].extend(record["blocks"])
+            journal["members"].extend(record["members"])
+            journal["files"].update(record["files"])
+    if journal["header"] is None or journal["header"].get("version") != JOURNAL_VERSION:
+        raise ValueError(f"Unreadable backup journal: {journal_file}")
+    return journal
+
+def find_unfinished_backup(location):
+    """Returns the final path of the newest interrupted backup in location, or None."""
+    location = Path(location)
+    if not location.is_dir():
+        return None
+    for journal_file in sorted(location.glob(f"{BACKUP_PREFIX}*{JOURNAL_SUFFIX}"), reverse=True):
+        backup_file = journal_file.with_name(journal_file.name[: -len(JOURNAL_SUFFIX)])
+        if sidecar_path(backup_file, PARTIAL_SUFFIX).exists():
+            return backup_file
+    return None
+
+def discard_unfinished_backup(backup_file):
+    for suffix in (PARTIAL_SUFFIX, JOURNAL_SUFFIX):
+        sidecar_path(backup_file, suffix).unlink(missing_ok=True)
+
+def lock_partial(archive):
+    """Locks an open .partial file for as long as it is being written, so no cleanup takes a running job for an interrupted one."""
+    try:
+        fcntl.flock(archive.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        archive.close()
+        raise RuntimeError(f"{archive.name} is being written by another process") from None
+
+def unfinished_backup_running(backup_file):
+    try:
+        with open(sidecar_path(backup_file, PARTIAL_SUFFIX), "rb") as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_SH | fcntl.LOCK_NB)
+    except FileNotFoundError:
+        return False
+    except BlockingIOError:
+        return True
+    return False
+
+def discard_superseded_backups(backup_file):
+    """Deletes unfinished backups older than a completed backup_file and returns their names.
+
+    Only the newest one can be resumed, so older ones would otherwise stay
+    in the save location for good. Jobs still being written are kept.
+    """
+    created = backup_timestamp(backup_file.name)
+    removed = []
+    for journal_file in sorted(backup_file.parent.glob(f"{BACKUP_PREFIX}*{JOURNAL_SUFFIX}")):
+        unfinished = journal_file.with_name(journal_file.name[: -len(JOURNAL_SUFFIX)])
+        started = backup_timestamp(unfinished.name)
+        if created is None or started is None or started >= created or unfinished_backup_running(unfinished):
+            continue
+        discard_unfinished_backup(unfinished)
+        removed.append(unfinished.name)
+    return removed
+
+def prepare_save_location(settings):
+    if not settings.save_location.exists():
+        try:
+            settings.save_location.mkdir(parents=True, exist_ok=True)
+            debug_print(f"Created default save location: {settings.save_location}")
+        except OSError as e:
+            raise OSError(f"Failed to create default save location: {str(e)}") from e
+
+def run_backup(items, settings, abort_event=None, progress=None, home=None):
+    """Backs up items (absolute paths below home) and returns a BackupResult; raises BackupAborted."""
+    home = Path(home or Path.home())
+    abort_event = abort_event or Event()
+    progress = progress or ProgressCounters()
+    prepare_save_location(settings)
+
+    if settings.backup_format == FORMAT_STORE:
+        return run_store_backup(items, settings, abort_event, progress, home)
+
+    backup_file = settings.save_location / f"{BACKUP_PREFIX}{timestamp_now()}.{settings.archive_extension()}"
+
+    # Incremental backups compare against the newest manifest in the save location
+    parent_file, parent_manifest = (None, None)
+    if settings.incremental:
+        parent_file, parent_manifest = find_latest_manifest(settings.save_location)
+
+    writer = ArchiveWriter(backup_file, settings, parent_file, parent_manifest, instruments=progress.instruments)
+    writer.start_journal(items, home)
+    return write_archive(writer, items, abort_event, progress, home)
+
+def run_stream_backup(items, stream, settings, abort_event=None, progress=None, home=None):
+    """Writes a full archive to a writable, possibly non-seekable binary stream such as stdout or a pipe.
+
+    Memory stays bounded: the scan queue and the compressor's in-flight
+    blocks are the only buffers, and no per-file records are kept.
+    """
+    if settings.backup_format != FORMAT_ARCHIVE or settings.incremental:
+        raise ValueError("Only full archive backups can be streamed")
+    progress = progress or ProgressCounters()
+    writer = ArchiveWriter(None, settings, stream=stream, instruments=progress.instruments)
+    return write_archive(writer, items, abort_event or Event(), progress, Path(home or Path.home()))
+
+def resume_backup(location, abort_event=None, progress=None, workers=DEFAULT_COMPRESSION_WORKERS, bandwidth_limit=None):
+    """Continues the newest interrupted backup in location from its last checkpoint."""
+    backup_file = find_unfinished_backup(location)
+    if backup_file is None:
+        raise FileNotFoundError(f"No unfinished backup in {location}")
+    journal = read_journal(sidecar_path(backup_file, JOURNAL_SUFFIX))
+    header = journal["header"]
+    settings = BackupSettings(
+        save_location=location,
+        compression_enabled=header["codec"] is not None,
+        codec=header["codec"] or CODEC_GZIP,
+        level=header["level"],
+        workers=workers,
+        incremental=header["parent"] is not None,
+        exclusions=ExclusionRules.from_dict(header["exclusions"]),
+        bandwidth_limit=bandwidth_limit,
+    )
+    parent_file = Path(location) / header["parent"] if header["parent"] else None
+    parent_manifest = load_manifest(parent_file) if parent_file else None
+    if parent_file and parent_manifest is None:
+        raise FileNotFoundError(f"The parent backup {parent_file.name} of this incremental is gone")
+    debug_print(f"Resuming {backup_file.name} with {len(journal['files'])} entries already stored")
+    progress = progress or ProgressCounters()
+    writer = ArchiveWriter(backup_file, settings, parent_file, parent_manifest, journal, instruments=progress.instruments)
+    return write_archive(writer, header["items"], abort_event or Event(), progress, Path(header["home"]))
+
+def finish_report(instruments, path, operation, **fields):
+    """Saves the run report when instrumentation is on; returns a line to append to the summary."""
+    if not instruments.enabled:
+        return ""
+    try:
+        instruments.save(path, operation, **fields)
+    except OSError as e:
+        debug_print(f"Could not save the run report: {e}")
+        instruments.stop_profile()
+        return ""
+    return f"\nRun report: {instruments.report_file}"
+
+def save_backup_report(writer, progress, status):
+    files, num_bytes, _, _ = progress.sample()
+    return finish_report(
+        writer.instruments,
+        writer.backup_file if writer.stream is None else report_path("stream"),
+        "backup",
+        status=status,
+        archive=writer.backup_file.name if writer.stream is None else None,
+        codec=writer.index["codec"],
+        level=writer.settings.level,
+        workers=writer.settings.workers,
+        incremental=writer.manifest["type"] == "incremental",
+        files=files,
+        bytes=num_bytes,
+        archive_bytes=writer.output.size,
+    )
+
+def write_archive(writer, items, abort_event, progress, home):
+    """Feeds scanned entries to writer with periodic checkpoints; an abort keeps the job resumable."""
+    instruments = writer.instruments
+    estimate = ScanEstimate()
+    progress.estimate = estimate
+    try:
+        for entry in stream_scan(items, home, abort_event, estimate, writer.settings.exclusions, instruments):
+            if abort_event.is_set():
+                break
+            started = time.perf_counter()
+            try:
+                writer.add(entry)
+            except FileNotFoundError:
+                debug_print(f"Skipping file removed during backup: {entry.path}")
+            instruments.file_done("archive", entry.arcname, started, entry_bytes(entry.stat))
+            progress.add(1, entry_bytes(entry.stat))
+            if writer.checkpoint_due():
+                with instruments.stage("checkpoint"):
+                    writer.checkpoint()
+    except BaseException:
+        writer.suspend(checkpoint=False)  # The last checkpoint is the one to resume from
+        save_backup_report(writer, progress, "failed")
+        raise
+
+    if abort_event.is_set():
+        debug_print("Backup aborted by user.")
+        writer.suspend()
+        save_backup_report(writer, progress, "aborted")
+        if writer.stream is not None:
+            raise BackupAborted("Backup was aborted, the streamed archive is incomplete!")
+        raise BackupAborted("Backup was paused, it can be resumed later.")
+
+    with instruments.stage("finalize"):
+        writer.close()
+    if writer.stream is not None:
+        checksum = writer.index["checksum"]
+        report_line = save_backup_report(writer, progress, "completed")
+        return BackupResult(None, f"Streamed {format_size(checksum['size'])}, {checksum['algorithm']} {checksum['hash']}{report_line}")
+    with instruments.stage("catalog"):
+        update_catalog(writer.settings.save_location, writer.backup_file)
+    superseded = discard_superseded_backups(writer.backup_file)
+    report_line = save_backup_report(writer, progress, "completed")
+    summary = f"Backup completed: {writer.backup_file}{report_line}"
+    if superseded:
+        summary += f"\nRemoved {len(superseded)} older interrupted backups: {', '.join(superseded)}"
+    return BackupResult(writer.backup_file, summary)
+
+def run_store_backup(items, settings, abort_event, progress, home):
+    store = ChunkStore(settings.save_location / STORE_DIRNAME).open()
+    if settings.bandwidth_limit:
+        store.limiter = RateLimiter(settings.bandwidth_limit)
+    timestamp = timestamp_now()
+    snapshot = {"name": f"{SNAPSHOT_PREFIX}{timestamp}", "created": timestamp, "items": list(items), "files": {}}
+    estimate = ScanEstimate()
+    progress.estimate = estimate
+    instruments = progress.instruments
+    status = "failed"
+
+    try:
+        with store.locked():  # Chunks this snapshot reuses cannot be garbage collected until it is saved
+            previous = store.latest_snapshot()
+            previous_files = previous["files"] if previous else {}
+            for entry in stream_scan(items, home, abort_event, estimate, settings.exclusions, instruments):
+                if abort_event.is_set():
+                    break
+                started = time.perf_counter()
+                try:
+                    record = store.snapshot_entry(entry, previous_files.get(entry.arcname))
+                except FileNotFoundError:
+                    debug_print(f"Skipping file removed during backup: {entry.path}")
+                    continue
+                instruments.file_done("store", entry.arcname, started, entry_bytes(entry.stat))
+                if record is not None:
+                    snapshot["files"][entry.arcname] = record
+                progress.add(1, entry_bytes(entry.stat))
+
+            if abort_event.is_set():
+                # Chunks already written stay unreferenced until the next garbage collection
+                debug_print("Snapshot aborted by user.")
+                status = "aborted"
+                raise BackupAborted("Backup was aborted!")
+
+            with instruments.stage("finalize"):
+                store.save_snapshot(snapshot)
+        with instruments.stage("catalog"):
+            update_catalog(settings.save_location, store.snapshots_dir / f"{snapshot['name']}.json")
+        status = "completed"
+    finally:
+        instruments.count("new chunks", store.new_chunks)
+        instruments.count("new chunk bytes", store.new_bytes)
+        # Reports live outside snapshots/, where every .json is taken for a snapshot
+        report_line = finish_report(
+            instruments, store.root / "reports" / snapshot["name"], "backup",
+            status=status, snapshot=snapshot["name"], files=progress.files, bytes=progress.bytes,
+        )
+    summary = (
+        f"Snapshot completed: {snapshot['name']}\n"
+        f"{store.new_chunks} new chunks, {store.new_bytes / (1024 * 1024):.1f} MB added to the store"
+        f"{report_line}"
+    )
+    return BackupResult(store.snapshots_dir / f"{snapshot['name']}.json", summary)
+
+def list_backups(location, sort="newest", text=None, refresh=True):
+    """Returns (backup id, label) for every archive and snapshot in location, read from the catalog."""
+    with BackupCatalog(location) as catalog:
+        if refresh:
+            catalog.refresh()
+        return [(entry["id"], catalog_label(entry)) for entry in catalog.query(sort, text)]
+
+def restore_archive(backup_file, destination, progress=None):
+    """Restores a whole archive; incrementals are rebuilt from the base archive plus every incremental in the chain."""
+    backup_file = Path(backup_file)
+    progress = progress or ProgressCounters()
+    plan = resolve_restore_chain(backup_file)
+    if plan is None:
+        plan = {backup_file.name: None}
+    missing = [name for name in plan if not (backup_file.parent / name).exists()]
+    if missing:
+        raise FileNotFoundError(f"Missing archives in backup chain: {', '.join(missing)}")
+
+    progress.add_totals(sum(len(names) for names in plan.values() if names is not None))
+    hashes = manifest_hashes(backup_file)
+
+    # Oldest archive first so newer content always wins
+    for archive_name in sorted(plan):
+        wanted = plan[archive_name]
+        with open_archive(backup_file.parent / archive_name) as tar, ParallelExtractor(destination, progress, hashes=hashes) as extractor:
+            for member in tar:
+                if wanted is None:
+                    # Legacy archive without a manifest: counted as it goes, since a zstd stream cannot be read twice
+                    progress.add_totals(1)
+                elif member.name not in wanted:
+                    continue
+                extractor.add_member(tar, member)
+
+def wanted_member(name, names):
+    """Whether a member is one of names or lies inside one of them."""
+    if names is None or name in names:
+        return True
+    parent = os.path.dirname(name)
+    while parent:
+        if parent in names:
+            return True
+        parent = os.path.dirname(parent)
+    return False
+
+def restore_stream(stream, destination=None, names=None, progress=None):
+    """Restores an archive read forward-only from a binary stream (stdin, a pipe), optionally only some paths."""
+    destination = Path(destination or Path.home())
+    progress = progress or ProgressCounters()
+    status = "failed"
+    try:
+        with open_stream_archive(stream) as tar, ParallelExtractor(destination, progress) as extractor:
+            unresolved = restore_members(tar, extractor, lambda name: wanted_member(name, names), progress=progress)[1]
+            if unresolved:
+                links = sorted(name for names in unresolved.values() for name in names)
+                raise FileNotFoundError(f"Hard links whose target is not selected, restore it too: {', '.join(links)}")
+        status = "completed"
+    finally:
+        finish_report(progress.instruments, report_path("restore"), "restore", status=status, destination=str(destination), files=progress.files, bytes=progress.bytes)
+
+def run_restore(backup, location, destination=None, names=None, progress=None):
+    """Restores a backup id from list_backups (or an archive path), optionally only the given paths."""
+    destination = Path(destination or Path.home())
+    progress = progress or ProgressCounters()
+    status = "failed"
+    try:
+        if backup.startswith(SNAPSHOT_ID_PREFIX):
+            store = ChunkStore(Path(location) / STORE_DIRNAME)
+            store.restore_snapshot(backup[len(SNAPSHOT_ID_PREFIX):], destination, progress, names)
+        elif names:
+            restore_selected(Path(location) / backup, names, destination, progress)
+        else:
+            restore_archive(Path(location) / backup, destination, progress)
+        status = "completed"
+    finally:
+        finish_report(
+            progress.instruments, report_path("restore"), "restore",
+            status=status, backup=backup, destination=str(destination), selected=len(names or ()), files=progress.files, bytes=progress.bytes,
+        )
+
+def verify_segment(fd, offset, length, expected):
+    """Re-hashes one segment of an archive file; pread lets every worker share the descriptor."""
+    hasher = hashlib.new(HASH_ALGORITHM)
+    while length > 0:
+        data = os.pread(fd, min(length, COMPRESSION_BLOCK_SIZE), offset)
+        if not data:
+            break
+        hasher.update(data)
+        offset += len(data)
+        length -= len(data)
+    return hasher.hexdigest() == expected
+
+def verify_members(backup_file, index, records, progress):
+    """Decompresses one contiguous run of members and compares their content hashes."""
+    problems = []
+    with IndexedArchive(backup_file, index) as archive:
+        for record, expected in records:
+            hasher = hashlib.new(HASH_ALGORITHM)
+            try:
+                archive.seek(record["offset"])
+                remaining = record["size"]
+                while remaining > 0:
+                    data = archive.read(min(remaining, COMPRESSION_BLOCK_SIZE))
+                    hasher.update(data)
+                    remaining -= len(data)
+            except (OSError, EOFError, zlib.error) as e:
+                problems.append(f"{record['name']}: unreadable: {e}")
+                archive.stream = None  # Start afresh at the next member's block
+                continue
+            if hasher.hexdigest() != expected:
+                problems.append(f"{record['name']}: checksum mismatch")
+            progress.add(1, record["size"])
+    return problems
+
+def split_runs(records, parts):
+    """Splits offset-ordered records into about `parts` runs of similar byte size."""
+    target = max(1, sum(record["size"] for record, _ in records) // parts)
+    runs, run, run_bytes = [], [], 0
+    for item in records:
+        run.append(item)
+        run_bytes += item[0]["size"]
+        if run_bytes >= target:
+            runs.append(run)
+            run, run_bytes = [], 0
+    if run:
+        runs.append(run)
+    return runs
+
+def verify_archive_sequential(backup_file, expected, progress):
+    """Fallback for archives written before indexes existed: one pass through tarfile."""
+    problems = []
+    try:
+        with open_archive(backup_file) as tar:
+            for member in tar:
+                entry = expected.pop(member.name, None)
+                if not member.isreg() or member.sparse is not None:
+                    continue  # Sparse members are hashed as stored, but tarfile only reads them back expanded
+                hasher = hashlib.new(HASH_ALGORITHM)
+                source = tar.extractfile(member)
+                for block in iter(lambda: source.read(COMPRESSION_BLOCK_SIZE), b""):
+                    hasher.update(block)
+                if entry is not None and entry["hash"] and entry["hash"] != hasher.hexdigest():
+                    problems.append(f"{member.name}: checksum mismatch")
+                progress.add(1, member.size)
+    except (OSError, EOFError, tarfile.TarError, zlib.error) as e:
+        problems.append(f"Archive unreadable: {e}")
+    return problems
+
+def verify_backup(backup, location, progress=None, workers=VERIFY_WORKERS):
+    """Checks a backup against its recorded checksums on a thread pool and returns a list of problems.
+
+    An empty list means it is intact. Archives are checked twice over: the
+    file itself segment by segment, then every member's content hash, with
+    runs of members decompressed concurrently from their index blocks.
+    """
+    progress = progress or ProgressCounters()
+    workers = max(1, workers)
+    problems = []
+    if backup.startswith(SNAPSHOT_ID_PREFIX):
+        store = ChunkStore(Path(location) / STORE_DIRNAME)
+        files = store.load_snapshot(backup[len(SNAPSHOT_ID_PREFIX):])["files"]
+        chunk_ids = {chunk_id for record in files.values() for chunk_id in record.get("chunks", ())}
+        progress.add_totals(len(chunk_ids))
+
+        def check_chunk(chunk_id):
+            try:
+                data = store.get_chunk(chunk_id)
+            except (OSError, zlib.error) as e:
+                return f"Chunk {chunk_id} unreadable: {e}"
+            progress.add(1, len(data))
+            if hashlib.blake2b(data, digest_size=32).hexdigest() != chunk_id:
+                return f"Chunk {chunk_id} is corrupted"
+            return None
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return [problem for problem in executor.map(check_chunk, chunk_ids) if problem]
+
+    backup_file = Path(location) / backup
+    manifest = load_manifest(backup_file) or {"files": {}}
+    expected = {name: entry for name, entry in manifest["files"].items() if entry["archive"] == backup_file.name}
+    index = load_index(backup_file)
+    if index is None:
+        progress.add_totals(len(expected))
+        problems = verify_archive_sequential(backup_file, expected, progress)
+        problems.extend(f"{name}: missing from archive" for name in sorted(expected))
+        return problems
+
+    checksum = index.get("checksum")
+    records = [
+        (record, expected[record["name"]]["hash"])
+        for record in index["members"]
+        if record["type"] == "file" and expected.get(record["name"], {}).get("hash")
+    ]
+    indexed_names = {record["name"] for record in index["members"]}
+    progress.add_totals(len(records), sum(record["size"] for record, _ in records) + (checksum["size"] if checksum else 0))
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        if checksum is not None:
+            size = backup_file.stat().st_size
+            if size != checksum["size"]:
+                problems.append(f"Archive is {size} bytes, expected {checksum['size']}")
+            segment_size = checksum["segment_size"]
+            with open(backup_file, "rb") as f:
+                jobs = []
+                for number, digest in enumerate(checksum["segments"]):
+                    length = min(segment_size, checksum["size"] - number * segment_size)
+                    jobs.append((number, length, executor.submit(verify_segment, f.fileno(), number * segment_size, length, digest)))
+                for number, length, job in jobs:
+                    if not job.result():
+                        problems.append(f"Archive bytes {number * segment_size}-{number * segment_size + length} are corrupted")
+                    progress.add(0, length)
+
+        runs = split_runs(sorted(records, key=lambda item: item[0]["offset"]), workers * 4)
+        for run_problems in executor.map(lambda run: verify_members(backup_file, index, run, progress), runs):
+            problems.extend(run_problems)
+    problems.extend(f"{name}: missing from archive" for name in sorted(set(expected) - indexed_names))
+    return problems
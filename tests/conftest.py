@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# The engine is a single module next to the scripts, not an installed package
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,93 @@
+import os
+import stat
+
+from rebornos_profile_engine import ExclusionRules, gitignore_regex, strip_pattern
+
+FILE = os.stat_result((stat.S_IFREG | 0o644, 0, 0, 1, 0, 0, 100, 0, 0, 0))
+DIRECTORY = os.stat_result((stat.S_IFDIR | 0o755, 0, 0, 1, 0, 0, 4096, 0, 0, 0))
+
+def excluded(patterns, path, stat_result=FILE):
+    return ExclusionRules(patterns, skip_caches=False).excludes(path, stat_result)
+
+def test_unanchored_pattern_matches_at_any_depth():
+    assert excluded(["*.log"], "app.log")
+    assert excluded(["*.log"], ".cache/app/app.log")
+    assert not excluded(["*.log"], "app.log.txt")
+
+def test_star_and_question_mark_stay_within_one_folder():
+    assert not excluded(["/Documents/*.pdf"], "Documents/old/a.pdf")
+    assert excluded(["/Documents/*.pdf"], "Documents/a.pdf")
+    assert excluded(["file?.txt"], "file1.txt")
+    assert not excluded(["file?.txt"], "file10.txt")
+
+def test_leading_or_inner_slash_anchors_at_home():
+    assert excluded(["/build"], "build", DIRECTORY)
+    assert not excluded(["/build"], "src/build", DIRECTORY)
+    assert excluded([".local/share/Steam/"], ".local/share/Steam", DIRECTORY)
+    assert not excluded([".local/share/Steam/"], "backup/.local/share/Steam", DIRECTORY)
+
+def test_trailing_slash_matches_folders_only():
+    assert excluded(["logs/"], "logs", DIRECTORY)
+    assert not excluded(["logs/"], "logs")
+
+def test_double_star():
+    assert excluded(["**/node_modules"], "node_modules", DIRECTORY)
+    assert excluded(["**/node_modules"], "code/web/node_modules", DIRECTORY)
+    assert excluded(["/Videos/**"], "Videos/clips/a.mkv")
+    assert not excluded(["/Videos/**"], "Videos", DIRECTORY)
+    assert excluded(["a/**/z"], "a/z")
+    assert excluded(["a/**/z"], "a/b/c/z")
+    assert not excluded(["a/**/z"], "b/a/z")
+
+def test_character_classes():
+    assert excluded(["*.[oa]"], "lib.a")
+    assert not excluded(["*.[oa]"], "lib.so")
+    assert excluded(["*.[!o]"], "lib.a")
+    assert not excluded(["*.[!o]"], "main.o")
+
+def test_negation_reincludes_and_the_last_match_wins():
+    patterns = ["*.log", "!keep.log"]
+    assert excluded(patterns, "debug.log")
+    assert not excluded(patterns, "keep.log")
+    assert not excluded(patterns, "app/keep.log")
+    assert excluded(patterns + ["app/keep.log"], "app/keep.log")
+
+def test_comments_and_blank_lines_are_ignored():
+    rules = ExclusionRules(["# a comment", "", "   ", "*.tmp"])
+    assert rules.patterns == ["*.tmp"]
+
+def test_backslash_escapes_a_leading_hash_or_bang():
+    assert excluded(["\\#notes"], "#notes")
+    assert not excluded(["\\#notes"], "notes")
+    assert excluded(["\\!important"], "!important")
+    assert not excluded(["\\!important"], "important")
+
+def test_backslash_makes_wildcards_literal():
+    assert excluded(["what\\?"], "what?")
+    assert not excluded(["what\\?"], "whats")
+    assert excluded(["\\*"], "*")
+    assert not excluded(["\\*"], "anything")
+
+def test_trailing_spaces_are_dropped_unless_escaped():
+    assert strip_pattern("build   \n") == "build"
+    assert strip_pattern("name\\ \n") == "name\\ "
+    assert strip_pattern("name\\\\ ") == "name\\\\"  # An escaped backslash does not escape the space
+    assert excluded(["name\\ "], "name ")
+    assert not excluded(["name\\ "], "name")
+    assert excluded(["name   "], "name")
+
+def test_escaped_space_in_the_middle():
+    assert gitignore_regex("My\\ Files/") == gitignore_regex("My Files/")
+    assert excluded(["My\\ Files/"], "My Files", DIRECTORY)
+
+def test_size_limit_applies_to_files_only():
+    rules = ExclusionRules([], max_file_size=50, skip_caches=False)
+    assert rules.excludes("big.iso", FILE)
+    assert not rules.excludes("folder", DIRECTORY)
+
+def test_rules_survive_a_journal_round_trip():
+    rules = ExclusionRules(["*.log", "!keep.log", "name\\ "], 1000, False)
+    copy = ExclusionRules.from_dict(rules.to_dict())
+    assert copy.to_dict() == rules.to_dict()
+    assert copy.excludes("name ", FILE)
+    assert not copy.excludes("keep.log", FILE)
@@ -0,0 +1,122 @@
+import io
+import os
+from contextlib import contextmanager
+
+import pytest
+
+import rebornos_profile_engine as engine
+
+def make_linked_home(home):
+    (home / "Pictures").mkdir(parents=True)
+    (home / "Documents").mkdir()
+    (home / "Pictures" / "big").write_bytes(os.urandom(2 * 1024 * 1024))
+    os.link(home / "Pictures" / "big", home / "Documents" / "big-link")
+    os.link(home / "Pictures" / "big", home / "Documents" / "another-link")
+    (home / "Documents" / "notes").write_bytes(b"notes\n")
+    return [str(home / "Pictures"), str(home / "Documents")]
+
+def same_file(*paths):
+    return len({os.stat(path).st_ino for path in paths}) == 1
+
+def fixed_timestamps(monkeypatch):
+    """Gives every backup its own name, however fast they follow each other."""
+    timestamps = iter(f"2026-01-01_10-00-{second:02}" for second in range(60))
+    monkeypatch.setattr(engine, "timestamp_now", lambda: next(timestamps))
+
+@contextmanager
+def forward_only(path):
+    """Reads every archive the way .tar.zst archives are read: one pass, no seeking back."""
+    with open(path, "rb") as raw, engine.open_stream_archive(raw) as tar:
+        yield tar
+
+@pytest.mark.parametrize("sidecars", [(engine.INDEX_SUFFIX,), (engine.INDEX_SUFFIX, engine.MANIFEST_SUFFIX)])
+def test_forward_only_archive_restores_a_link_without_its_target(tmp_path, monkeypatch, sidecars):
+    monkeypatch.setattr(engine, "open_archive", forward_only)
+    home = tmp_path / "home"
+    items = make_linked_home(home)
+    result = engine.run_backup(items, engine.BackupSettings(save_location=tmp_path / "backups"), home=home)
+    for suffix in sidecars:
+        engine.sidecar_path(result.path, suffix).unlink()
+
+    destination = tmp_path / "restored"
+    engine.restore_selected(result.path, ["Documents"], destination)
+    assert not (destination / "Pictures").exists()
+    assert (destination / "Documents" / "big-link").read_bytes() == (home / "Pictures" / "big").read_bytes()
+    assert os.stat(destination / "Documents" / "big-link").st_ino == os.stat(destination / "Documents" / "another-link").st_ino
+    assert (destination / "Documents" / "notes").read_bytes() == b"notes\n"
+
+@pytest.mark.parametrize("compression", [True, False])
+def test_sparse_file_keeps_its_holes(tmp_path, compression):
+    home = tmp_path / "home"
+    (home / "VMs").mkdir(parents=True)
+    with open(home / "VMs" / "disk.img", "wb") as f:
+        f.truncate(8 * 1024 * 1024)
+        f.seek(4 * 1024 * 1024)
+        f.write(os.urandom(100 * 1024))
+    if os.stat(home / "VMs" / "disk.img").st_blocks * 512 >= 8 * 1024 * 1024:
+        pytest.skip("the filesystem does not keep holes")
+    settings = engine.BackupSettings(save_location=tmp_path / "backups", compression_enabled=compression)
+    result = engine.run_backup([str(home / "VMs")], settings, home=home)
+
+    destination = tmp_path / "restored"
+    engine.run_restore(result.path.name, result.path.parent, destination)
+    restored = destination / "VMs" / "disk.img"
+    assert restored.read_bytes() == (home / "VMs" / "disk.img").read_bytes()
+    assert os.stat(restored).st_blocks * 512 < 8 * 1024 * 1024
+
+@pytest.mark.parametrize("compression", [True, False])
+def test_hard_links_survive_a_full_backup(tmp_path, compression):
+    home = tmp_path / "home"
+    items = make_linked_home(home)
+    settings = engine.BackupSettings(save_location=tmp_path / "backups", compression_enabled=compression)
+    result = engine.run_backup(items, settings, home=home)
+
+    destination = tmp_path / "restored"
+    engine.run_restore(result.path.name, result.path.parent, destination)
+    assert same_file(destination / "Pictures" / "big", destination / "Documents" / "big-link", destination / "Documents" / "another-link")
+    assert (destination / "Documents" / "big-link").read_bytes() == (home / "Pictures" / "big").read_bytes()
+
+def test_selected_link_without_its_target_gets_its_content(tmp_path):
+    home = tmp_path / "home"
+    items = make_linked_home(home)
+    result = engine.run_backup(items, engine.BackupSettings(save_location=tmp_path / "backups"), home=home)
+
+    destination = tmp_path / "restored"
+    engine.run_restore(result.path.name, result.path.parent, destination, names=["Documents/big-link"])
+    assert not (destination / "Pictures").exists()
+    assert (destination / "Documents" / "big-link").read_bytes() == (home / "Pictures" / "big").read_bytes()
+
+@pytest.mark.parametrize("new_path_first", [True, False])
+def test_link_added_between_incremental_backups(tmp_path, monkeypatch, new_path_first):
+    fixed_timestamps(monkeypatch)
+    home = tmp_path / "home"
+    items = make_linked_home(home)
+    (home / "Albums").mkdir()
+    items = [str(home / "Albums")] + items if new_path_first else items + [str(home / "Albums")]
+    settings = engine.BackupSettings(save_location=tmp_path / "backups", compression_enabled=False, incremental=True)
+    engine.run_backup(items, settings, home=home)
+    os.link(home / "Pictures" / "big", home / "Albums" / "big")
+    result = engine.run_backup(items, settings, home=home)
+    assert result.path.stat().st_size < 1024 * 1024  # A link to the older archive, not a second copy
+
+    destination = tmp_path / "restored"
+    engine.run_restore(result.path.name, result.path.parent, destination)
+    assert same_file(destination / "Pictures" / "big", destination / "Albums" / "big", destination / "Documents" / "big-link")
+
+    destination = tmp_path / "selected"
+    engine.run_restore(result.path.name, result.path.parent, destination, names=["Albums"])
+    assert (destination / "Albums" / "big").read_bytes() == (home / "Pictures" / "big").read_bytes()
+
+@pytest.mark.parametrize("names", [None, {"Documents"}])
+def test_hard_links_survive_a_stream(tmp_path, names):
+    home = tmp_path / "home"
+    items = make_linked_home(home)
+    stream = io.BytesIO()
+    engine.run_stream_backup(items, stream, engine.BackupSettings(save_location=tmp_path), home=home)
+
+    stream.seek(0)
+    destination = tmp_path / "restored"
+    engine.restore_stream(stream, destination, names)
+    assert same_file(destination / "Documents" / "big-link", destination / "Documents" / "another-link")
+    assert (destination / "Documents" / "big-link").read_bytes() == (home / "Pictures" / "big").read_bytes()
+    assert (destination / "Pictures").exists() == (names is None)
@@ -0,0 +1,103 @@
+import filecmp
+import random
+from threading import Event
+
+import pytest
+
+import rebornos_profile_engine as engine
+
+def make_home(home):
+    rng = random.Random(14)
+    for folder in ("Documents", ".config/app", ".local/share/notes"):
+        (home / folder).mkdir(parents=True)
+        for number in range(12):
+            size = rng.choice((100, 3000, 200 * 1024))
+            (home / folder / f"file{number}").write_bytes(rng.randbytes(size))
+    return [str(home / "Documents"), str(home / ".config"), str(home / ".local")]
+
+class AbortAfter(engine.ProgressCounters):
+    """Progress that pulls the abort event once a number of files are stored, like the Abort button."""
+
+    def __init__(self, files, abort_event):
+        super().__init__()
+        self.limit = files
+        self.abort_event = abort_event
+
+    def add(self, files=0, num_bytes=0):
+        super().add(files, num_bytes)
+        if self.files >= self.limit:
+            self.abort_event.set()
+
+def same_tree(left, right):
+    comparison = filecmp.dircmp(left, right)
+    if comparison.left_only or comparison.right_only or comparison.diff_files or comparison.funny_files:
+        return False
+    _, mismatch, errors = filecmp.cmpfiles(left, right, comparison.common_files, shallow=False)
+    return not mismatch and not errors and all(same_tree(left / name, right / name) for name in comparison.common_dirs)
+
+@pytest.mark.parametrize("compression", [True, False])
+def test_interrupted_backup_resumes_from_its_last_checkpoint(tmp_path, monkeypatch, compression):
+    monkeypatch.setattr(engine, "CHECKPOINT_BYTES", 256 * 1024)
+    home = tmp_path / "home"
+    items = make_home(home)
+    location = tmp_path / "backups"
+    settings = engine.BackupSettings(save_location=location, compression_enabled=compression, workers=2)
+
+    abort_event = Event()
+    with pytest.raises(engine.BackupAborted):
+        engine.run_backup(items, settings, abort_event, AbortAfter(20, abort_event), home=home)
+
+    backup_file = engine.find_unfinished_backup(location)
+    assert backup_file is not None and not backup_file.exists()
+    journal = engine.read_journal(engine.sidecar_path(backup_file, engine.JOURNAL_SUFFIX))
+    committed = set(journal["files"])
+    assert 0 < len(committed) < 39  # Three folders, 36 files
+
+    # Bytes written after the checkpoint when the process died are dropped on resume
+    with open(engine.sidecar_path(backup_file, engine.PARTIAL_SUFFIX), "ab") as f:
+        f.write(b"torn write" * 1000)
+
+    result = engine.resume_backup(location, workers=2)
+    assert result.path == backup_file and backup_file.exists()
+    assert engine.find_unfinished_backup(location) is None
+    assert not engine.sidecar_path(backup_file, engine.JOURNAL_SUFFIX).exists()
+
+    manifest = engine.load_manifest(backup_file)
+    assert committed <= set(manifest["files"])
+    names = [record["name"] for record in engine.load_index(backup_file)["members"]]
+    assert len(names) == len(set(names)) == len(manifest["files"])  # Nothing stored twice
+    assert engine.verify_backup(backup_file.name, location) == []
+
+    destination = tmp_path / "restored"
+    engine.run_restore(backup_file.name, location, destination)
+    assert same_tree(home, destination)
+
+def test_resume_without_an_unfinished_backup_fails(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        engine.resume_backup(tmp_path)
+
+def test_a_completed_backup_removes_older_interrupted_ones(tmp_path, monkeypatch):
+    home = tmp_path / "home"
+    items = make_home(home)
+    location = tmp_path / "backups"
+    settings = engine.BackupSettings(save_location=location, compression_enabled=False)
+    monkeypatch.setattr(engine, "CHECKPOINT_BYTES", 256 * 1024)
+
+    abort_event = Event()
+    monkeypatch.setattr(engine, "timestamp_now", lambda: "2026-01-01_10-00-00")
+    with pytest.raises(engine.BackupAborted):
+        engine.run_backup(items, settings, abort_event, AbortAfter(20, abort_event), home=home)
+    interrupted = engine.find_unfinished_backup(location)
+
+    # Still being written by another process, so it stays
+    running = location / f"{engine.BACKUP_PREFIX}2026-01-01_09-00-00.tar"
+    engine.sidecar_path(running, engine.JOURNAL_SUFFIX).write_text("{}\n")
+    with open(engine.sidecar_path(running, engine.PARTIAL_SUFFIX), "w+b") as partial:
+        engine.lock_partial(partial)
+        monkeypatch.setattr(engine, "timestamp_now", lambda: "2026-01-01_11-00-00")
+        result = engine.run_backup(items, settings, home=home)
+
+    assert interrupted.name in result.summary
+    assert not engine.sidecar_path(interrupted, engine.PARTIAL_SUFFIX).exists()
+    assert not engine.sidecar_path(interrupted, engine.JOURNAL_SUFFIX).exists()
+    assert engine.sidecar_path(running, engine.PARTIAL_SUFFIX).exists()